@@ -1,10 +1,9 @@
 import argparse
+import mbtiles
 import sqlite3
-import math
 from osgeo import gdal
 from PIL import Image
 import io
-import sys
 
 def get_existing_zoom_level(db_path):
     """Get the zoom level from the MBTILES metadata"""
@@ -69,14 +68,16 @@ def create_lower_zoom_tile(tiles):
 
 def process_zoom_levels(mbtiles_path, target_zoom=7):
     """Generate lower zoom levels down to target_zoom"""
-    conn = sqlite3.connect(mbtiles_path)
-    cursor = conn.cursor()
-    
     # Get starting zoom level
     start_zoom = get_existing_zoom_level(mbtiles_path)
     if start_zoom <= target_zoom:
         print(f"Starting zoom ({start_zoom}) is already at or below target ({target_zoom})")
         return
+
+    # New tiles are written by a writer thread, while this thread reads the
+    # tiles of the next higher zoom level
+    writer = mbtiles.MBTilesWriter(mbtiles_path, append=True)
+    conn = mbtiles.connect(mbtiles_path)
     
     # Process each zoom level
     for current_zoom in range(start_zoom - 1, target_zoom - 1, -1):
@@ -102,24 +103,28 @@ def process_zoom_levels(mbtiles_path, target_zoom=7):
                 # Create and save new tile
                 new_tile_data = create_lower_zoom_tile(child_tiles)
                 if new_tile_data:
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO tiles 
-                        (zoom_level, tile_column, tile_row, tile_data) 
-                        VALUES (?, ?, ?, ?)
-                    """, (current_zoom, x, y, new_tile_data))
+                    writer.put(current_zoom, x, y, new_tile_data)
         
         # Update metadata
-        cursor.execute("""
-            UPDATE metadata SET value = ? 
-            WHERE name = 'minzoom'
-        """, (current_zoom,))
-        
-        conn.commit()
+        writer.setMetadata({'minzoom': current_zoom})
+
+        # The next zoom level is built from this one, which must therefore be
+        # written completely
+        writer.flush()
     
     conn.close()
+    writer.close()
     print("Processing complete")
 
-def GeoTIFF2MBTILES(infile, outfile):
+def GeoTIFF2MBTILES(infile, outfile, deduplicate=False):
+    """Convert a GeoTIFF file to MBTILES, with WEBP tiles down to zoom level 7
+
+    Args:
+        infile (str): Path to the GeoTIFF file
+        outfile (str): Path to the MBTILES file
+        deduplicate (bool, optional): Store identical tiles only once, see the
+            module 'mbtiles'
+    """
     # Open the input dataset
     gdal.UseExceptions()
     ds = gdal.Open(infile)
@@ -131,6 +136,9 @@ def GeoTIFF2MBTILES(infile, outfile):
 
     process_zoom_levels(outfile, target_zoom=7)
 
+    if deduplicate:
+        mbtiles.deduplicate(outfile)
+
 def update_mbtiles_metadata(mbtiles_path, attribution=None, description=None, version=None):
     """
     Update attribution and description fields in an MBTILES file.
@@ -214,10 +222,10 @@ def update_mbtiles_metadata(mbtiles_path, attribution=None, description=None, ve
             conn.close()
     
 if __name__ == "__main__":
-    # If no arguments, print help and exit
-    if len(sys.argv) != 3:
-        print("Convert GeoTIFF files to MBTiles format")
-        print("Usage:")
-        print("python GeoTIFF2MBTILES.py input.tif output.mbtiles")
-        sys.exit(-1)
-    GeoTIFF2MBTILES(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(description="Convert GeoTIFF files to MBTiles format")
+    parser.add_argument("input", help="GeoTIFF file")
+    parser.add_argument("output", help="MBTiles file")
+    parser.add_argument("--deduplicate", action="store_true",
+                        help="Store identical tiles only once")
+    args = parser.parse_args()
+    GeoTIFF2MBTILES(args.input, args.output, args.deduplicate)
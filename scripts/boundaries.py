@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+"""
+boundaries
+=======================================================================================================
+
+Country boundaries from the Natural Earth data set, as used to cut maps to the
+regions listed in the module 'regions'.
+
+The country map is large and takes several seconds to read. It is therefore
+read only when a boundary is first needed, and kept in memory afterwards.
+Scripts that need nothing but the region table should import 'regions' only.
+"""
+
+import functools
+
+
+countryMapFileName = 'data/ne_10m_admin_0_countries/ne_10m_admin_0_countries.dbf'
+
+
+@functools.lru_cache(maxsize=None)
+def worldCountryMap():
+    """Returns the Natural Earth map of all countries of the world
+
+    The map is read on first call. Later calls return the same object, which
+    must therefore not be modified.
+
+    :returns: geopandas GeoDataFrame
+    """
+    import geopandas
+
+    print('Read country boundary file')
+    return geopandas.read_file(countryMapFileName)
+
+
+def countryBoundary(country):
+    """Returns the boundary of a country
+
+    :param country: Name of the country, as used in the column 'SOVEREIGNT' of
+        the Natural Earth map
+
+    :returns: geopandas GeoDataFrame
+    """
+    countryMap = worldCountryMap()
+    countryGDF = countryMap[countryMap.SOVEREIGNT == country]
+    if countryGDF.size == 0:
+        print('Error in countryBoundary(), country is empty: ' + country)
+        exit(-1)
+    return countryGDF
+
+
+@functools.lru_cache(maxsize=None)
+def bufferedCountry(country):
+    """Returns polygons that contain a given country, with a 20km buffer
+    around the country boundaries
+
+    The result is computed on first call. Later calls return the same object,
+    which must therefore not be modified.
+
+    :param country: Name of the country, as used in the column 'SOVEREIGNT' of
+        the Natural Earth map
+
+    :returns: geopandas GeoSeries
+    """
+    return countryBoundary(country).to_crs(crs=3857).buffer(20000).to_crs(crs=4326)
+
+
+def bufferedBoundary(region):
+    """Returns polygons that contain a given region, with a 20km buffer around the region boundaries
+
+    :param region: Entry of the array 'regions.regions'
+
+    :returns: geopandas geometry
+    """
+    from shapely.geometry import Polygon
+
+    # Intersect the boundary of the country with the bounding box of the region
+    bbox = Polygon([(region['bbox'][0],region['bbox'][1]), (region['bbox'][0],region['bbox'][3]), (region['bbox'][2],region['bbox'][3]), (region['bbox'][2],region['bbox'][1])])
+    countryGDF = countryBoundary(region["country"]).intersection(bbox)
+
+    # Compute and return buffer
+    return countryGDF.to_crs(crs=3857).buffer(20000).to_crs(crs=4326)
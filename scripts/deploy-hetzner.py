@@ -14,6 +14,10 @@ serverURL = 'https://enroute-data.akaflieg-freiburg.de/enroute-GeoJSONv003'
 whatsNewText = 'Enroute Flight Navigation now offers maps for Brunei, Malaysia, and Thailand.'
 minAppVersion = '2.31.8'
 
+# Manifests written by splitAviationMap.py, relative to the output directory
+aviationMapManifestFileName = '../aviationMapManifest.json'
+pendingAviationMapManifestFileName = '../aviationMapManifest.pending.json'
+
 # Go to output directory
 os.chdir('out')
 
@@ -129,3 +133,10 @@ subprocess.run(
     shell=True,
     check=True
 )
+
+#
+# The aviation maps are now on the server. Record their features as deployed,
+# so that splitAviationMap.py does not write them again.
+#
+if os.path.exists(pendingAviationMapManifestFileName):
+    os.replace(pendingAviationMapManifestFileName, aviationMapManifestFileName)
@@ -5,7 +5,6 @@ Usage: python icao_downloader.py --zoom 7 --bbox 5.8,47.2,15.1,55.1 --output ger
 """
 
 import argparse
-import sqlite3
 import sys
 import time
 from pathlib import Path
@@ -14,6 +13,7 @@ import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import math
+import mbtiles
 
 # Tile server URL
 TILE_URL = "https://secais.dfs.de/static-maps/icao500/tiles/{z}/{x}/{y}.png"
@@ -53,45 +53,6 @@ def download_tile(z: int, x: int, y: int, session: requests.Session) -> Tuple[in
         print(f"Error downloading tile {z}/{x}/{y}: {e}", file=sys.stderr)
         return z, x, y, b"", False
 
-def create_mbtiles(output_path: str, name: str = "Germany ICAO Map", description: str = "ICAO 500k map tiles"):
-    """Create an MBTiles database with metadata."""
-    conn = sqlite3.connect(output_path)
-    cursor = conn.cursor()
-    
-    # Create tables
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS metadata (
-            name TEXT PRIMARY KEY,
-            value TEXT
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS tiles (
-            zoom_level INTEGER,
-            tile_column INTEGER,
-            tile_row INTEGER,
-            tile_data BLOB,
-            PRIMARY KEY (zoom_level, tile_column, tile_row)
-        )
-    """)
-    
-    # Insert metadata
-    metadata = {
-        "name": name,
-        "type": "baselayer",
-        "version": "1.0",
-        "description": description,
-        "format": "png",
-        "attribution": "DFS Deutsche Flugsicherung GmbH"
-    }
-    
-    for key, value in metadata.items():
-        cursor.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", (key, value))
-    
-    conn.commit()
-    return conn
-
 def flip_y(y: int, zoom: int) -> int:
     """Convert TMS (bottom-left origin) to XYZ (top-left origin) tile coordinates."""
     return (2 ** zoom - 1) - y
@@ -108,6 +69,8 @@ def main():
                         help="Number of parallel download workers (default: 4)")
     parser.add_argument("--delay", type=float, default=0.1,
                         help="Delay between requests in seconds (default: 0.1)")
+    parser.add_argument("--deduplicate", action="store_true",
+                        help="Store identical tiles only once, e.g. empty chart margins. An existing output file is then replaced instead of extended")
     
     args = parser.parse_args()
     
@@ -118,24 +81,34 @@ def main():
         print("Error: Invalid bounding box format. Use 'min_lon,min_lat,max_lon,max_lat'", file=sys.stderr)
         sys.exit(1)
     
+    # Each zoom level is downloaded once, even if it is given repeatedly
+    args.zoom = sorted(set(args.zoom))
+    
     print(f"Downloading tiles for bbox: ({min_lon}, {min_lat}) to ({max_lon}, {max_lat})")
     print(f"Zoom levels: {args.zoom}")
     print(f"Output: {args.output}")
     
-    # Create MBTiles database
-    conn = create_mbtiles(args.output)
-    cursor = conn.cursor()
-    
-    # Update bounds in metadata
-    cursor.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
-                   ("bounds", f"{min_lon},{min_lat},{max_lon},{max_lat}"))
-    cursor.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
-                   ("minzoom", str(min(args.zoom))))
-    cursor.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
-                   ("maxzoom", str(max(args.zoom))))
-    cursor.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
-                   ("center", f"{(min_lon + max_lon) / 2},{(min_lat + max_lat) / 2},{min(args.zoom)}"))
-    conn.commit()
+    # Tiles are added to an existing output file, replacing tiles with the
+    # same coordinates. Deduplicated files cannot be extended and are written
+    # anew. Tiles are written by the writer's own thread, so that downloading
+    # does not wait for the database.
+    append = False
+    if Path(args.output).exists() and not args.deduplicate:
+        connection = mbtiles.connect(args.output)
+        append = not mbtiles.isDeduplicated(connection)
+        connection.close()
+    writer = mbtiles.MBTilesWriter(args.output, {
+        "name": "Germany ICAO Map",
+        "type": "baselayer",
+        "version": "1.0",
+        "description": "ICAO 500k map tiles",
+        "format": "png",
+        "attribution": "DFS Deutsche Flugsicherung GmbH",
+        "bounds": f"{min_lon},{min_lat},{max_lon},{max_lat}",
+        "minzoom": str(min(args.zoom)),
+        "maxzoom": str(max(args.zoom)),
+        "center": f"{(min_lon + max_lon) / 2},{(min_lat + max_lat) / 2},{min(args.zoom)}"
+    }, deduplicate=args.deduplicate, append=append)
     
     session = requests.Session()
     session.headers.update({"User-Agent": "ICAO-Tile-Downloader/1.0"})
@@ -169,18 +142,13 @@ def main():
                     if success and len(data) > 0:
                         # Convert to TMS y-coordinate (MBTiles uses TMS)
                         tms_y = flip_y(y, z)
-                        cursor.execute(
-                            "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
-                            (z, x, tms_y, data)
-                        )
+                        writer.put(z, x, tms_y, data)
                         successful_tiles += 1
                     
                     pbar.update(1)
                     time.sleep(args.delay)
-        
-        conn.commit()
     
-    conn.close()
+    writer.close()
     
     print(f"\n✓ Download complete!")
     print(f"  Total tiles attempted: {total_tiles}")
@@ -1,58 +1,273 @@
 #!/usr/bin/python3
 
+import argparse
+import concurrent.futures
+import contextlib
+import geofabrik
 import os
-import subprocess
-import sys
+import threading
 import vector_tile
 
 import regions
 
-myRegions = [
-    region for region in regions.regions
-    if any(arg in region['name'] or arg in region['continent'] for arg in sys.argv[1:])
+tileCacheFileName = "cache/vectortiles.sqlite"
+
+# Statistics reports are kept out of the directory 'out', because
+# deploy-hetzner.py uploads every text file found there
+statsDirectory = "stats"
+
+# Filter expressions for 'osmium tags-filter'. Changing them invalidates the
+# cached filtered files.
+osmFilter = [
+    "/aerialway=cable_car,gondola,zip_line,goods",
+    "/aeroway",
+    "/admin_level=2",
+    "/highway=motorway,trunk,primary,secondary,motorway_link",
+    "/landuse",
+    "/natural",
+    "/place=city,town,village",
+    "/railway",
+    "/water",
+    "/waterway"
 ]
 
-for continent in regions.continents:
-    if len([region for region in myRegions if (region['continent'] == continent['name'])]) == 0:
-        continue
-
-    print('Download {}'.format(continent['name']))
-    try:
-        os.remove('download.pbf')
-    except BaseException as err:
-        True
-    subprocess.run(['curl', continent['osmUrl'], "-L",
-                   "--output", "download.pbf"], check=True)
-
-    print('Run Osmium tags-filter')
-    subprocess.run(
-        ["osmium",
-         "tags-filter",
-         'download.pbf',
-         "/aerialway=cable_car,gondola,zip_line,goods",
-         "/aeroway",
-         "/admin_level=2",
-         "/highway=motorway,trunk,primary,secondary,motorway_link",
-         "/landuse",
-         "/natural",
-         "/place=city,town,village",
-         "/railway",
-         "/water",
-         "/waterway",
-         "-o", "out.pbf",
-         "--overwrite"],
-        check=True
-    )
-    os.remove('download.pbf')
-
-    for region in [region for region in myRegions if (region['continent'] == continent['name'])]:
-        bbox = region['bbox']
-        vector_tile.pbf2mbtiles(
-            'out.pbf', bbox[0], bbox[1], bbox[2], bbox[3], region['name'], region['country'])
+# Rough memory estimates in GB, used to decide how many regions can be
+# processed at the same time. Tilemaker keeps the whole extract in memory, in
+# a representation that is several times larger than the PBF file.
+osmiumMemory = 2.0
+tilemakerMemoryPerPBFGB = 12.0
+tilemakerMemoryBase = 1.0
+optimizeMemory = 2.0
+
+
+class ResourceBudget:
+    """CPUs and memory shared by the region pipelines
+
+    Every stage of a pipeline reserves the CPUs and memory it is going to use,
+    and waits until enough of both are free. A stage that asks for more than
+    the whole budget is granted the whole budget, so that it runs alone
+    rather than never.
+    """
+
+    def __init__(self, cpus, memory):
+        self.cpus = cpus
+        self.memory = memory
+        self.freeCpus = cpus
+        self.freeMemory = memory
+        self.condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, cpus, memory):
+        cpus = min(cpus, self.cpus)
+        memory = min(memory, self.memory)
+        with self.condition:
+            self.condition.wait_for(lambda: self.freeCpus >= cpus and self.freeMemory >= memory)
+            self.freeCpus -= cpus
+            self.freeMemory -= memory
         try:
-            os.remove("out/"+continent['name']+"/"+region['name']+'.mbtiles')
+            yield
+        finally:
+            with self.condition:
+                self.freeCpus += cpus
+                self.freeMemory += memory
+                self.condition.notify_all()
+
+
+def processRegion(continent, region, pbfFileName):
+    """Render, cut and optimize the base map of one region
+
+    The region runs through two stages, tilemaker and the optimization in
+    vector_tile.rewriteVectorTiles, each of which reserves its share of the
+    budget. Intermediate files carry the name of the region, so that several
+    regions can be processed at the same time. The result is written to a
+    temporary file next to its final location and renamed when complete.
+
+    :param continent: Entry of the array 'regions.continents'
+
+    :param region: Entry of the array 'regions.regions'
+
+    :param pbfFileName: Extract of the region, as written by
+        vector_tile.extractRegions. The file is removed once tilemaker is done.
+    """
+    bbox = region['bbox']
+    workDirectory = "work/"+continent['name']
+    outDirectory = "out/"+continent['name']
+    os.makedirs(workDirectory, exist_ok=True)
+    os.makedirs(outDirectory, exist_ok=True)
+    rawFileName = workDirectory+"/"+region['name']+'.raw.mbtiles'
+    outFileName = outDirectory+"/"+region['name']+'.mbtiles'
+
+    tilemakerMemory = tilemakerMemoryBase + tilemakerMemoryPerPBFGB*os.path.getsize(pbfFileName)/2**30
+    with budget.reserve(stageCpus, tilemakerMemory):
+        vector_tile.runTilemaker(pbfFileName, bbox[0], bbox[1], bbox[2], bbox[3], rawFileName, threads=stageCpus)
+    os.remove(pbfFileName)
+
+    if args.stats:
+        with budget.reserve(stageCpus, optimizeMemory):
+            print('{}: Compute tile statistics'.format(region['name']))
+            os.makedirs(statsDirectory+"/"+continent['name'], exist_ok=True)
+            vector_tile.writeStatisticsReport(
+                vector_tile.vectorTileStatistics(rawFileName, region['country'], processes=stageCpus, keepTinyPolygons=args.keep_tiny_polygons),
+                statsDirectory+"/"+continent['name']+"/"+region['name']+'.stats')
+
+    with budget.reserve(stageCpus, optimizeMemory):
+        print('{}: Remove tiles that do not intersect {} and optimize vector tiles'.format(region['name'], region['country']))
+        vector_tile.rewriteVectorTiles(
+            rawFileName, outFileName+'.tmp', region['country'],
+            processes=stageCpus, deduplicate=args.deduplicate, name=region['name']+'.mbtiles', cache=tileCache,
+            keepTinyPolygons=args.keep_tiny_polygons)
+    os.remove(rawFileName)
+    os.replace(outFileName+'.tmp', outFileName)
+    print('{}: Done'.format(region['name']))
+
+
+def processContinent(continent, continentRegions, pbfFileName):
+    """Render and optimize a continent once, then cut out its regions
+
+    This is the alternative to processRegion that is used with the option
+    --continent-master. Tiles near borders that several regions share are
+    rendered and optimized only once. The master file is rendered for the
+    union of the bounding boxes of the regions and is not cut to any country.
+    The regions are then cut out with vector_tile.sliceRegion, which copies
+    tiles in bulk without touching their content.
+
+    :param continent: Entry of the array 'regions.continents'
+
+    :param continentRegions: Entries of the array 'regions.regions' that
+        belong to the continent
+
+    :param pbfFileName: Extract of the union of the bounding boxes, as written
+        by vector_tile.extractRegions. The file is removed once tilemaker is
+        done.
+    """
+    bbox = continentBBox(continentRegions)
+    workDirectory = "work/"+continent['name']
+    outDirectory = "out/"+continent['name']
+    os.makedirs(workDirectory, exist_ok=True)
+    os.makedirs(outDirectory, exist_ok=True)
+    rawFileName = workDirectory+"/master.raw.mbtiles"
+    masterFileName = workDirectory+"/master.mbtiles"
+
+    tilemakerMemory = tilemakerMemoryBase + tilemakerMemoryPerPBFGB*os.path.getsize(pbfFileName)/2**30
+    with budget.reserve(stageCpus, tilemakerMemory):
+        vector_tile.runTilemaker(pbfFileName, bbox[0], bbox[1], bbox[2], bbox[3], rawFileName, threads=stageCpus)
+    os.remove(pbfFileName)
+
+    if args.stats:
+        with budget.reserve(stageCpus, optimizeMemory):
+            print('{}: Compute tile statistics'.format(continent['name']))
+            os.makedirs(statsDirectory+"/"+continent['name'], exist_ok=True)
+            vector_tile.writeStatisticsReport(
+                vector_tile.vectorTileStatistics(rawFileName, processes=stageCpus, keepTinyPolygons=args.keep_tiny_polygons),
+                statsDirectory+"/"+continent['name']+"/"+continent['name']+'.stats')
+
+    with budget.reserve(stageCpus, optimizeMemory):
+        print('{}: Optimize vector tiles'.format(continent['name']))
+        vector_tile.rewriteVectorTiles(rawFileName, masterFileName, processes=stageCpus, deduplicate=args.deduplicate, cache=tileCache,
+                                       keepTinyPolygons=args.keep_tiny_polygons)
+    os.remove(rawFileName)
+
+    for region in continentRegions:
+        regionBBox = region['bbox']
+        outFileName = outDirectory+"/"+region['name']+'.mbtiles'
+        with budget.reserve(1, optimizeMemory):
+            vector_tile.sliceRegion(
+                masterFileName, regionBBox[0], regionBBox[1], regionBBox[2], regionBBox[3], outFileName+'.tmp',
+                region['country'], deduplicate=args.deduplicate, name=region['name']+'.mbtiles')
+        os.replace(outFileName+'.tmp', outFileName)
+        print('{}: Done'.format(region['name']))
+    os.remove(masterFileName)
+
+
+def continentBBox(continentRegions):
+    """Compute the union of the bounding boxes of several regions
+
+    :param continentRegions: Entries of the array 'regions.regions'
+
+    :returns: List [minLon, minLat, maxLon, maxLat]
+    """
+    return [min(region['bbox'][0] for region in continentRegions),
+            min(region['bbox'][1] for region in continentRegions),
+            max(region['bbox'][2] for region in continentRegions),
+            max(region['bbox'][3] for region in continentRegions)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate base maps for all regions whose name or continent contains one of the given strings")
+    parser.add_argument("regions", nargs="*",
+                        help="Region or continent names, or parts thereof")
+    parser.add_argument("--deduplicate", action="store_true",
+                        help="Store identical tiles only once, see the module 'mbtiles'")
+    parser.add_argument("--cpus", type=int, default=os.cpu_count(),
+                        help="Number of CPUs shared by all regions that are processed at the same time (default: all)")
+    parser.add_argument("--memory", type=float, default=os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')/2**30,
+                        help="Memory in GB shared by all regions that are processed at the same time (default: all)")
+    parser.add_argument("--stage-cpus", type=int, default=None,
+                        help="Number of CPUs used by one tilemaker run or one optimization run (default: half of --cpus)")
+    parser.add_argument("--continent-master", action="store_true",
+                        help="Render and optimize every continent once, and cut the regions out of the result")
+    parser.add_argument("--stats", action="store_true",
+                        help="Write a report on tile sizes per zoom level and layer, before and after optimization, for each map into the directory "+statsDirectory)
+    parser.add_argument("--no-tile-cache", action="store_true",
+                        help="Optimize every tile, instead of reusing results of earlier runs from "+tileCacheFileName)
+    parser.add_argument("--keep-tiny-polygons", action="store_true",
+                        help="Do not drop polygons that are smaller than the minimal areas in vector_tile.layerRules")
+    parser.add_argument("--no-refresh", action="store_true",
+                        help="Use cached continent downloads without checking for newer versions")
+    args = parser.parse_args()
+
+    tileCache = None if args.no_tile_cache else tileCacheFileName
+    stageCpus = args.stage_cpus if args.stage_cpus is not None else max(1, args.cpus//2)
+
+    budget = ResourceBudget(args.cpus, args.memory)
+
+    myRegions = [
+        region for region in regions.regions
+        if any(arg in region['name'] or arg in region['continent'] for arg in args.regions)
+    ]
+
+    # Continents are downloaded and filtered one after the other, see the module
+    # 'geofabrik' for the caching of downloads and filtered files. The regions of
+    # a continent are handed to the executor as soon as their extracts exist, and
+    # run concurrently with each other and with the next continent download,
+    # within the limits of the budget.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(myRegions)))
+    futures = {}
+
+    for continent in regions.continents:
+        continentRegions = [region for region in myRegions if (region['continent'] == continent['name'])]
+        if len(continentRegions) == 0:
+            continue
+
+        with budget.reserve(1, osmiumMemory):
+            pbfFileName = geofabrik.filteredPBF(continent['osmUrl'], osmFilter, refresh=not args.no_refresh)
+
+            # Cut all regional extracts out of the continent in one pass. With
+            # --continent-master, a single extract covers all regions.
+            extractDirectory = "extracts/"+continent['name']
+            if args.continent_master:
+                extracts = [('master.pbf', continentBBox(continentRegions))]
+            else:
+                extracts = [(region['name']+'.pbf', region['bbox']) for region in continentRegions]
+            vector_tile.extractRegions(pbfFileName, extracts, directory=extractDirectory)
+
+        if args.continent_master:
+            future = executor.submit(processContinent, continent, continentRegions, extractDirectory+"/master.pbf")
+            futures[future] = {'name': continent['name']}
+            continue
+        for region in continentRegions:
+            future = executor.submit(processRegion, continent, region, extractDirectory+"/"+region['name']+'.pbf')
+            futures[future] = region
+
+    failed = []
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            future.result()
         except BaseException as err:
-            True
-        os.makedirs("out/"+continent['name'], exist_ok=True)
-        os.replace(region['name']+'.mbtiles', "out/"+continent['name']+"/"+region['name']+'.mbtiles')
-    os.remove('out.pbf')
+            print('Error processing {}: {}'.format(futures[future]['name'], err))
+            failed.append(futures[future]['name'])
+    executor.shutdown()
+
+    if len(failed) > 0:
+        print('Failed regions: {}'.format(', '.join(failed)))
+        exit(-1)
@@ -1,3 +1,4 @@
+import argparse
 import requests
 import os
 import shutil
@@ -21,6 +22,10 @@ maps = [
         'url': 'https://data.geo.admin.ch/ch.bazl.segelflugkarte/segelflugkarte/segelflugkarte_total_30_2056.tif'
     }
 ]
+parser = argparse.ArgumentParser(description="Download raster charts and convert them to MBTiles format")
+parser.add_argument("--deduplicate", action="store_true",
+                    help="Store identical tiles only once, see the module 'mbtiles'")
+args = parser.parse_args()
 
 for map in maps:
     print(map['name'])
@@ -67,6 +72,6 @@ for map in maps:
     directory = os.path.dirname(local_filename_raster)
     if directory != "":
         os.makedirs(directory, exist_ok=True)
-    GeoTIFF2MBTILES.GeoTIFF2MBTILES(local_filename_tiff, local_filename_raster)
+    GeoTIFF2MBTILES.GeoTIFF2MBTILES(local_filename_tiff, local_filename_raster, args.deduplicate)
     GeoTIFF2MBTILES.update_mbtiles_metadata(local_filename_raster, map['attribution'], map['description'], remote_time)
     shutil.move(local_filename_raster, "out/" + map['continent'] + "/" + local_filename_raster)
@@ -1,13 +1,17 @@
 #!/usr/bin/python3
 
+import argparse
+import asyncio
+import concurrent.futures
+import glob
+import hashlib
+import io
+import json
 import math
-import multiprocessing
+import mbtiles
+import numpy
 import os
-from urllib import response
-import requests
-import sqlite3
-import subprocess
-import sys
+import random
 import time
 import vector_tile
 
@@ -30,80 +34,528 @@ def deg2num(lat_deg, lon_deg, zoom):
     return (xtile, ytile)
 
 
-def getWebp(zoom, x, y):
+#
+# Cache of terrarium tiles
+#
+# Source tiles are kept in cacheDirectory/z/x/y.png, next to a JSON file with
+# the ETag of the tile and the time when it was last checked against the
+# server. A cached tile is used without network access for
+# cacheRevalidateAge seconds, and then revalidated with a conditional
+# request. The WebP files produced from a source tile are cached as well, in
+# files whose name contains a hash of the ETag of the source tile and of
+# processingVersion, so that they are encoded only once for all regions.
+#
 
-    retries = 1
-    success = False
-    while not success:
+terrariumUrl = 'https://s3.amazonaws.com/elevation-tiles-prod/terrarium/{}/{}/{}.png'
+cacheDirectory = 'cache/terrarium'
+cacheRevalidateAge = 30*24*3600
+
+# Version of the code that makes WebP files, such as processTerrarium,
+# getWebpPyramid and encodeWebp. Increase this number whenever a change to
+# these functions changes the WebP files, so that cached files are not reused.
+processingVersion = 2
+
+
+def writeFileAtomically(fileName, data):
+    """Write a file, such that readers never see a partial file
+
+    Several worker processes may write the same cache file at the same time.
+    Each of them writes to its own temporary file and renames it.
+
+    :param fileName: Name of the file
+
+    :param data: bytes
+    """
+    os.makedirs(os.path.dirname(fileName), exist_ok=True)
+    tmpFileName = '{}.{}.tmp'.format(fileName, os.getpid())
+    with open(tmpFileName, 'wb') as file:
+        file.write(data)
+    os.replace(tmpFileName, fileName)
+
+
+def readCachedTerrarium(zoom, x, y):
+    """Read a terrarium tile from the cache
+
+    :param zoom: Zoom level
+
+    :param x: Tile column
+
+    :param y: Tile row, in the slippy map numbering
+
+    :returns: Triple (PNG file as bytes, ETag of the tile, True if the tile
+        need not be revalidated yet), or None if the tile is not cached
+    """
+    pngFileName = '{}/{}/{}/{}.png'.format(cacheDirectory, zoom, x, y)
+    try:
+        with open(pngFileName+'.json') as file:
+            info = json.load(file)
+        with open(pngFileName, 'rb') as file:
+            data = file.read()
+        return (data, info['etag'], time.time() - info['checked'] < cacheRevalidateAge)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def storeCachedTerrarium(zoom, x, y, data, etag):
+    """Write a terrarium tile into the cache, or mark a cached tile as checked
+
+    :param zoom: Zoom level
+
+    :param x: Tile column
+
+    :param y: Tile row, in the slippy map numbering
+
+    :param data: PNG file as bytes, or None if the cached file is current
+
+    :param etag: ETag of the tile
+    """
+    pngFileName = '{}/{}/{}/{}.png'.format(cacheDirectory, zoom, x, y)
+    if data is not None:
+        writeFileAtomically(pngFileName, data)
+    writeFileAtomically(pngFileName+'.json', json.dumps({'etag': etag, 'checked': time.time()}).encode())
+
+
+def removeCachedTerrarium(zoom, x, y):
+    """Remove a terrarium tile from the cache, so that it is downloaded again
+
+    :param zoom: Zoom level
+
+    :param x: Tile column
+
+    :param y: Tile row, in the slippy map numbering
+    """
+    pngFileName = '{}/{}/{}/{}.png'.format(cacheDirectory, zoom, x, y)
+    for fileName in [pngFileName, pngFileName+'.json']:
+        try:
+            os.remove(fileName)
+        except FileNotFoundError:
+            pass
+
+
+#
+# Downloads
+#
+# Tiles are downloaded by an asyncio client that reuses its connections. At
+# most 'connections' requests run at the same time. Failed requests are
+# repeated after a delay that grows exponentially, with random jitter so that
+# retries do not arrive in bursts. After maxRetries retries, or immediately
+# for client errors other than 429, the tile is reported as failed.
+#
+
+maxRetries = 6
+retryBaseDelay = 2
+retryMaxDelay = 120
+
+
+async def fetchTerrarium(session, zoom, x, y, failures):
+    """Get a terrarium tile, from the cache if possible
+
+    :param session: aiohttp.ClientSession
+
+    :param zoom: Zoom level
+
+    :param x: Tile column
+
+    :param y: Tile row, in the slippy map numbering
+
+    :param failures: List. If the tile cannot be downloaded, a pair (tile,
+        error message) is appended.
+
+    :returns: Pair (PNG file as bytes, ETag of the tile), or None if the tile
+        cannot be downloaded
+    """
+    import aiohttp
+
+    cached = readCachedTerrarium(zoom, x, y)
+    if cached is not None and cached[2]:
+        return cached[:2]
+    headers = {}
+    if cached is not None:
+        headers['If-None-Match'] = cached[1]
+
+    for attempt in range(maxRetries+1):
+        try:
+            async with session.get(terrariumUrl.format(zoom, x, y), headers=headers) as response:
+                if response.status == 304:
+                    storeCachedTerrarium(zoom, x, y, None, cached[1])
+                    return cached[:2]
+                response.raise_for_status()
+                data = await response.read()
+                etag = response.headers.get('ETag') or hashlib.sha256(data).hexdigest()
+            storeCachedTerrarium(zoom, x, y, data, etag)
+            return (data, etag)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            permanent = isinstance(err, aiohttp.ClientResponseError) and err.status < 500 and err.status != 429
+            if permanent or attempt == maxRetries:
+                failures.append( ((zoom, x, y), str(err) or type(err).__name__) )
+                return None
+            delay = min(retryMaxDelay, retryBaseDelay * 2**attempt) * random.uniform(0.5, 1.5)
+            await asyncio.sleep(delay)
+
+
+async def generateTiles(tiles, writer, zoomMin, zoomMax, pyramid=None, connections=16, tileSize=256):
+    """Download and convert terrain tiles, and write them
+
+    Downloads run in the event loop, while decoding and encoding run in a
+    process pool, so that both overlap. The number of tiles that have been
+    started but not yet written is bounded, so that memory consumption stays
+    bounded as well.
+
+    A tile whose terrarium tiles cannot be downloaded or converted is
+    reported as failed, while the other tiles are still made. Terrarium tiles
+    that cannot be converted are removed from the cache, so that the next run
+    downloads them again.
+
+    :param tiles: List of triples (zoom, x, y) in the slippy map numbering,
+        describing the tiles to be written
+
+    :param writer: mbtiles.MBTilesWriter
+
+    :param zoomMin: Lowest zoom level of the terrarium tiles
+
+    :param zoomMax: Highest zoom level of the terrarium tiles
+
+    :param pyramid: None, or the reducer for getWebpPyramid
+
+    :param connections: Maximal number of simultaneous downloads
+
+    :param tileSize: 256 or 512. Tiles of 512 pixels are stitched from the
+        four terrarium tiles of the next zoom level, so that their zoom
+        levels run from zoomMin-1 to zoomMax-1.
+
+    :returns: List of pairs (tile, error message) for tiles that could not be
+        downloaded or converted
+    """
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    failures = []
+    downloads = asyncio.Semaphore(connections)
+    pending = asyncio.Semaphore(connections + 2*os.cpu_count())
+
+    async def fetch(zoom, x, y):
+        async with downloads:
+            return await fetchTerrarium(session, zoom, x, y, failures)
+
+    def sourceTiles(block, sourceZoom):
+        # Terrarium tiles at sourceZoom that cover the block, row by row
+        (zoom, x, y) = block
+        n = 2**(sourceZoom-zoom)
+        return [(sourceZoom, x*n+dx, y*n+dy) for dy in range(n) for dx in range(n)]
+
+    async def makeTile(tile):
+        source = await fetch(*tile)
+        if source is None:
+            return []
+        return [await loop.run_in_executor(executor, getWebp, tile + source)]
+
+    async def makeBlock(block, sourceZoom, wanted):
+        # One task per block, which consists of one tile and all its
+        # descendants, made from the terrarium tiles at sourceZoom
+        n = 2**(sourceZoom-block[0])
+        sources = await asyncio.gather(*[fetch(*source) for source in sourceTiles(block, sourceZoom)])
+        if None in sources:
+            return []
+        sources = [sources[dy*n:(dy+1)*n] for dy in range(n)]
+        return await loop.run_in_executor(executor, getWebpPyramid, (block, sourceZoom, pyramid, wanted, sources, tileSize))
+
+    async def run(tile, sources, job):
         try:
-            response = requests.get(
-                'https://s3.amazonaws.com/elevation-tiles-prod/terrarium/{}/{}/{}.png'.format(zoom, x, y))
-            response.raise_for_status()
-            success = True
-        except Exception as e:
-            wait = retries * 30
-            print('Error! Waiting %s secs and re-trying...' % wait, flush=True)
-            time.sleep(wait)
-            retries += 1
-
-    pngFileName = '{}.{}.{}.png'.format(zoom, x, y)
-    webpFileName = '{}.{}.{}.webp'.format(zoom, x, y)
-
-    with open(pngFileName, 'wb') as f:
-        f.write(response.content)
-        f.close()
-
-    img = Image.open(pngFileName)
-    matrix = ( 1, 0, 0, 0,
-               0, 1, 0, 0,
-               0, 0, 0, 0)
-    img = img.convert("RGB", matrix)
-
-    #   
-    # Next, we can to delete all data that is below -127m MSL. 
-    #
-    # Get the dimensions of the image
-    width, height = img.size
-    # Process each pixel
-    for x in range(width):
-        for y in range(height):
-            # Get the RGB values of the current pixel
-            r, g, b = img.getpixel((x, y))
-
-            # Check the red value
-            if r < 128:
-                # Set new RGB values
-                new_r = 128
-                new_g = 0
-                new_b = 0
-
-                # Modify the pixel with the new values
-                img.putpixel((x, y), (new_r, new_g, new_b))
-
-    img.save(pngFileName)
-
-    subprocess.run(
-        ["cwebp",
-         pngFileName,
-         "-z", "9",
-         "-quiet",
-         "-noalpha",
-         "-o", webpFileName],
-        check=True
-    )
-    newBlob = open(webpFileName, 'rb').read()
-    os.remove(pngFileName)
-    
+            results = await job
+        except Exception as err:
+            failures.append( (tile, str(err) or type(err).__name__) )
+            for source in sources:
+                removeCachedTerrarium(*source)
+            return
+        finally:
+            pending.release()
+        for (zoom, x, y, blob) in results:
+            writer.put(zoom, x, 2**zoom-1-y, blob)
+
+    # Triples (tile, terrarium tiles used, coroutine that makes the tiles)
+    levels = int(math.log2(tileSize//256))
+    if pyramid is None and levels == 0:
+        jobs = ((tile, [tile], makeTile(tile)) for tile in tiles)
+    elif pyramid is None:
+        jobs = ((tile, sourceTiles(tile, tile[0]+levels), makeBlock(tile, tile[0]+levels, {tile})) for tile in tiles)
+    else:
+        blockZoom = zoomMin-levels
+        blocks = {}
+        for (zoom, x, y) in tiles:
+            scale = 2**(zoom-blockZoom)
+            blocks.setdefault((blockZoom, x//scale, y//scale), set()).add( (zoom, x, y) )
+        jobs = ((block, sourceTiles(block, zoomMax), makeBlock(block, zoomMax, wanted)) for (block, wanted) in blocks.items())
+
+    # The workers come from a fork server, because the writer thread and the
+    # resolver threads of aiohttp are running, see vector_tile.processContext
+    with concurrent.futures.ProcessPoolExecutor(mp_context=vector_tile.processContext) as executor:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections),
+                                         timeout=aiohttp.ClientTimeout(total=120)) as session:
+            tasks = []
+            for (tile, sources, job) in jobs:
+                await pending.acquire()
+                tasks.append(asyncio.create_task(run(tile, sources, job)))
+            await asyncio.gather(*tasks)
+    return failures
+
+
+def cachedWebp(zoom, x, y, version, makeImage, tileSize=256):
+    """Get a WebP tile from the cache, or make and cache it
+
+    :param zoom: Zoom level
+
+    :param x: Tile column
+
+    :param y: Tile row, in the slippy map numbering
+
+    :param version: String that identifies the source data of the tile, such
+        as the ETag of the terrarium tile
+
+    :param makeImage: Function without arguments that returns the PIL Image
+        to be encoded. It is called only if the tile is not cached.
+
+    :param tileSize: Size of the tile in pixels. Tiles of different sizes
+        are cached side by side.
+
+    :returns: WebP file as bytes
+    """
+    key = hashlib.sha256('{}/{}'.format(version, processingVersion).encode()).hexdigest()[:16]
+    name = '{}/{}/{}/{}'.format(cacheDirectory, zoom, x, y)
+    if tileSize != 256:
+        name += '-{}'.format(tileSize)
+    webpFileName = '{}.{}.webp'.format(name, key)
+    try:
+        with open(webpFileName, 'rb') as file:
+            return file.read()
+    except OSError:
+        pass
+
+    blob = encodeWebp(makeImage())
+    writeFileAtomically(webpFileName, blob)
+    # Remove WebP files made from older source tiles or by older code
+    for staleFileName in glob.glob(glob.escape(name)+'.*.webp'):
+        if staleFileName != webpFileName:
+            try:
+                os.remove(staleFileName)
+            except FileNotFoundError:
+                pass
+    return blob
+
+
+def getWebp(task):
+    """Convert a terrarium tile to WebP, using the cached file if possible
+
+    This is the unit of work that is handed to the worker processes.
+
+    :param task: Quintuple (zoom, x, y, PNG file as bytes, ETag), with x and
+        y in the slippy map numbering
+
+    :returns: Quadruple (zoom, x, y, WebP file as bytes)
+    """
+    (zoom, x, y, data, etag) = task
+    return (zoom, x, y, cachedWebp(zoom, x, y, etag, lambda: processTerrarium(data)))
+
+
+def getWebpPyramid(task):
+    """Convert the terrarium tiles of the highest zoom level in a block, and
+    derive the tiles of the lower zoom levels from them
+
+    The block consists of all descendants of one tile at the lowest zoom
+    level. All of them are given at the highest zoom level and assembled
+    into one elevation array. Going down one zoom level, the array is
+    reduced by aggregating blocks of 2x2 pixels. This is the unit of work
+    that is handed to the worker processes in pyramid mode, and for tiles of
+    512 pixels.
+
+    A tile of 512 pixels is cut from the elevation array of the next higher
+    zoom level, so that it holds the data of its four children.
+
+    :param task: Sextuple (tile, zoomMax, reducer, wanted, sources,
+        tileSize). Here, tile is a triple (zoom, x, y) in the slippy map
+        numbering, zoomMax is the zoom level of the terrarium tiles, reducer
+        is "mean" or "max", wanted is a set of the triples of the tiles that
+        are to be returned, sources[dy][dx] is the pair (PNG file as bytes,
+        ETag) of the descendant at zoomMax with offset (dx, dy), and tileSize
+        is 256 or 512.
+
+    :returns: List of quadruples (zoom, x, y, WebP file as bytes)
+    """
+    ((zoomMin, xMin, yMin), zoomMax, reducer, wanted, sources, tileSize) = task
+    n = 2**(zoomMax-zoomMin)
+    levels = int(math.log2(tileSize//256))
+
+    elevation = numpy.empty((256*n, 256*n))
+    etags = [[etag for (data, etag) in row] for row in sources]
+    for dx in range(n):
+        for dy in range(n):
+            elevation[256*dy:256*(dy+1), 256*dx:256*(dx+1)] = decodeTerrarium(sources[dy][dx][0])
+    # Clamp the sea floor to sea level before reducing, as encodeTerrarium
+    # would, so that the mean of coastal blocks is not pulled below the land
+    numpy.maximum(elevation, 0, out=elevation)
+
+    results = []
+    for zoom in range(zoomMax-levels, zoomMin-1, -1):
+        # Number of terrarium tiles per side of a tile at this zoom level
+        m = 2**(zoomMax-zoom)
+        for i in range(n//m):
+            for j in range(n//m):
+                (x, y) = (xMin*(n//m)+i, yMin*(n//m)+j)
+                if (zoom, x, y) not in wanted:
+                    continue
+                block = elevation[tileSize*j:tileSize*(j+1), tileSize*i:tileSize*(i+1)]
+                if m == 1:
+                    version = etags[j][i]
+                else:
+                    method = reducer if zoom < zoomMax-levels else 'stitched'
+                    version = method + ':' + hashlib.sha256(''.join(
+                        etags[dy][dx] for dy in range(j*m, (j+1)*m) for dx in range(i*m, (i+1)*m)
+                    ).encode()).hexdigest()
+                results.append( (zoom, x, y, cachedWebp(zoom, x, y, version, lambda: encodeTerrarium(block), tileSize)) )
+        if zoom > zoomMin:
+            elevation = reduceElevation(elevation, reducer)
+    return results
+
+
+def reduceElevation(elevation, reducer):
+    """Halve the resolution of an elevation array
+
+    :param elevation: numpy array of even height and width, with negative
+        elevations already clamped to zero
+
+    :param reducer: "mean" or "max". The latter keeps the highest elevation of
+        every 2x2 block, so that no obstacle gets lower on a coarser tile.
+
+    :returns: numpy array
+    """
+    (height, width) = elevation.shape
+    blocks = elevation.reshape(height//2, 2, width//2, 2)
+    if reducer == "max":
+        return blocks.max(axis=(1, 3))
+    return blocks.mean(axis=(1, 3))
+
+
+def encodeWebp(img):
+    """Encode an image as lossless WebP, in memory
+
+    The settings match 'cwebp -z 9': lossless compression with the slowest
+    and best method.
+
+    :param img: PIL Image in mode RGB
+
+    :returns: WebP file as bytes
+    """
+    buffer = io.BytesIO()
+    img.save(buffer, format="WEBP", lossless=True, quality=100, method=6)
+    return buffer.getvalue()
+
+
+def decodeTerrarium(data):
+    """Decode a terrarium tile into elevations
+
+    :param data: PNG file, as downloaded from the terrarium tile server
+
+    :returns: numpy array of elevations in meters, computed as
+        R*256 + G + B/256 - 32768
+    """
+    pixels = numpy.array(Image.open(io.BytesIO(data)).convert("RGB"), dtype=numpy.float64)
+    return pixels[:, :, 0]*256 + pixels[:, :, 1] + pixels[:, :, 2]/256 - 32768
+
+
+def encodeTerrarium(elevation):
+    """Encode elevations as a terrarium image for use in Enroute Flight
+    Navigation
+
+    Elevations are rounded down to full meters, so that the blue channel,
+    which holds fractions of a meter, is zero. Elevations below sea level are
+    set to zero, which is the pixel (128, 0, 0).
+
+    :param elevation: numpy array of elevations in meters
+
+    :returns: PIL Image in mode RGB
+    """
+    value = numpy.maximum(numpy.floor(elevation), 0).astype(numpy.int64) + 32768
+    pixels = numpy.zeros(elevation.shape + (3,), dtype=numpy.uint8)
+    pixels[:, :, 0] = value // 256
+    pixels[:, :, 1] = value % 256
+    return Image.fromarray(pixels, "RGB")
+
+
+def processTerrarium(data):
+    """Prepare a terrarium tile for use in Enroute Flight Navigation
+
+    The tile is decoded and encoded again with encodeTerrarium. This drops the
+    fractions of a meter and all data below sea level, that is, pixels whose
+    red value is below 128 become (128, 0, 0). All steps run as array
+    operations on the whole tile.
+
+    :param data: PNG file, as downloaded from the terrarium tile server
+
+    :returns: PIL Image in mode RGB
+    """
+    return encodeTerrarium(decodeTerrarium(data))
+
+
+def benchmark(numTiles):
+    """Measure the throughput of processTerrarium and encodeWebp
+
+    The benchmark runs on a synthetic 256x256 terrarium tile with elevations
+    from -500m to 3000m MSL, so that no network access is needed.
+
+    :param numTiles: Number of times the tile is processed
+    """
+    elevation = numpy.linspace(-500, 3000, 256*256).reshape(256, 256) + 32768
+    pixels = numpy.zeros((256, 256, 3), dtype=numpy.uint8)
+    pixels[:, :, 0] = elevation // 256
+    pixels[:, :, 1] = elevation % 256
+    pixels[:, :, 2] = (elevation*256) % 256
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(buffer, format="PNG")
+    data = buffer.getvalue()
+
+    start = time.perf_counter()
+    for i in range(numTiles):
+        img = processTerrarium(data)
+    duration = time.perf_counter() - start
+    print("processTerrarium: {} tiles in {:.2f}s, {:.1f} tiles/s".format(numTiles, duration, numTiles/duration))
+
+    start = time.perf_counter()
+    for i in range(numTiles):
+        encodeWebp(img)
+    duration = time.perf_counter() - start
+    print("encodeWebp: {} tiles in {:.2f}s, {:.1f} tiles/s".format(numTiles, duration, numTiles/duration))
+
 
 if __name__ == '__main__':
 
-    myRegion = ""
-    if len(sys.argv) > 1:
-        myRegion = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Generate terrain maps for all regions whose name or continent contains the given string")
+    parser.add_argument("region", nargs="?", default="",
+                        help="Region or continent name, or part thereof. Defaults to all regions")
+    parser.add_argument("--deduplicate", action="store_true",
+                        help="Store identical tiles only once, see the module 'mbtiles'")
+    parser.add_argument("--pyramid", choices=["mean", "max"], default=None,
+                        help="Download the highest zoom level only, and derive the lower zoom levels by aggregating 2x2 pixel blocks with the given reducer")
+    parser.add_argument("--tile-size", type=int, choices=[256, 512], default=256,
+                        help="Size of the tiles in pixels. Tiles of 512 pixels are stitched from four terrarium tiles of the next zoom level, and cover zoom levels one below those of 256-pixel tiles")
+    parser.add_argument("--connections", type=int, default=16,
+                        help="Maximal number of simultaneous downloads (default: 16)")
+    parser.add_argument("--benchmark", type=int, metavar="TILES", default=0,
+                        help="Measure the throughput of tile processing on the given number of synthetic tiles, and exit")
+    args = parser.parse_args()
+    myRegion = args.region
+
+    if args.benchmark > 0:
+        benchmark(args.benchmark)
+        exit(0)
 
     zoomMin = 7
     zoomMax = 10
 
+    # Zoom levels of the tiles written. A tile of 512 pixels holds the data of
+    # the four terrarium tiles at the next zoom level.
+    levels = int(math.log2(args.tile_size//256))
+    tileZoomMin = zoomMin-levels
+    tileZoomMax = zoomMax-levels
+
     attribution = """ArcticDEM terrain data DEM(s) were created from DigitalGlobe, Inc., imagery and funded under National Science Foundation awards 1043681, 1559691, and 1542736.
 Australia terrain data © Commonwealth of Australia (Geoscience Australia) 2017.
 Austria terrain data © offene Daten Österreichs – Digitales Geländemodell (DGM) Österreich.
@@ -117,6 +569,7 @@ United Kingdom terrain data © Environment Agency copyright and/or database righ
 United States 3DEP (formerly NED) and global GMTED2010 and SRTM terrain data courtesy of the U.S. Geological Survey.
 """.replace('\n', '<br>')
 
+    failedRegions = []
     for region in [region for region in regions.regions if myRegion in region['name'] or myRegion in region['continent']]:
         fileName = 'out/'+region['continent']+'/'+region['name']+'.terrain'
         bbox = region['bbox']
@@ -124,77 +577,46 @@ United States 3DEP (formerly NED) and global GMTED2010 and SRTM terrain data cou
         print("Working on country {}.".format(region['name']))
 
         tmpFileName = '{}.terrain'.format(region['name'])
-        dbConnection = None
-        try:
-            os.remove(tmpFileName)
-        except BaseException as err:
-            True
-        dbConnection = sqlite3.connect(tmpFileName)
-        cursor = dbConnection.cursor()
-        cursor.execute('CREATE TABLE metadata (name text, value text)')
-        cursor.execute("INSERT INTO metadata (name, value) VALUES ('name', '{}')".format(
-            region['continent']+'/'+region['name']))
-        cursor.execute(
-            "INSERT INTO metadata (name, value) VALUES ('type', 'baselayer')")
-        cursor.execute("INSERT INTO metadata (name, value) VALUES ('version', '{}')".format(
-            date.today().strftime("%d-%b-%Y")))
-        cursor.execute(
-            "INSERT INTO metadata (name, value) VALUES ('description', 'Terrain data for Enroute Flight Navigation')")
-        cursor.execute(
-            "INSERT INTO metadata (name, value) VALUES ('format', 'webp')")
-        cursor.execute(
-            "INSERT INTO metadata (name, value) VALUES ('encoding', 'terrarium')")
-        cursor.execute(
-            "INSERT INTO metadata (name, value) VALUES ('maxzoom', ?)", (str(zoomMax),))
-        cursor.execute(
-            "INSERT INTO metadata (name, value) VALUES ('minzoom', ?)", (str(zoomMin),))
-        cursor.execute(
-            "INSERT INTO metadata (name, value) VALUES ('attribution', ?)", (attribution,))
-        bboxString = str(bbox[0])+','+str(bbox[1]) + \
-            ','+str(bbox[2])+','+str(bbox[3])
-        cursor.execute(
-            "INSERT INTO metadata (name, value) VALUES ('bounds', '{}')".format(bboxString))
-        cursor.execute(
-            "INSERT INTO metadata (name, value) VALUES ('attribution', 'None yet')")
-        cursor.execute(
-            'CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)')
+        writer = mbtiles.MBTilesWriter(tmpFileName, {
+            'name': region['continent']+'/'+region['name'],
+            'type': 'baselayer',
+            'version': date.today().strftime("%d-%b-%Y"),
+            'description': 'Terrain data for Enroute Flight Navigation',
+            'format': 'webp',
+            'encoding': 'terrarium',
+            'maxzoom': tileZoomMax,
+            'minzoom': tileZoomMin,
+            'tileSize': args.tile_size,
+            'attribution': attribution,
+            'bounds': ','.join(str(coordinate) for coordinate in bbox)
+        }, deduplicate=args.deduplicate)
 
         tiles = []
-        for zoom in range(zoomMin, zoomMax+1):
+        for zoom in range(tileZoomMin, tileZoomMax+1):
             (xmin, ymax) = deg2num(bbox[1], bbox[0], zoom)
             (xmax, ymin) = deg2num(bbox[3], bbox[2], zoom)
             for x in range(xmin, xmax+1):
                 for y in range(ymin, ymax+1):
                     tiles.append( (zoom,x,y) )
-        foreignTiles = vector_tile.foreignTiles(tiles, region['country'])
+        foreignTiles = set(vector_tile.foreignTiles(tiles, region['country']))
         tiles = [tile for tile in tiles if tile not in foreignTiles]
 
-        pool = multiprocessing.Pool(multiprocessing.cpu_count())
-        pool.starmap(getWebp, tiles)
-        pool.close()
-        
-        for (zoom,x,y) in tiles:
-            yflipped = 2**zoom-1-y
-
-            webpFileName = '{}.{}.{}.webp'.format(zoom, x, y)
-            blob = open(webpFileName, 'rb').read()
-            os.remove(webpFileName)
+        # Tiles are written as they arrive, while other tiles are still being
+        # downloaded and encoded
+        failures = asyncio.run(generateTiles(tiles, writer, zoomMin, zoomMax, args.pyramid, args.connections, args.tile_size))
+        writer.close()
 
-            cursor.execute(
-                "INSERT INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)", (zoom, x, yflipped, blob))
-
-        dbConnection.commit()
-
-        cursor.execute(
-            "CREATE UNIQUE INDEX tile_index on tiles (zoom_level, tile_column, tile_row)")
-        dbConnection.commit()
-
-        cursor.execute("vacuum")
-        dbConnection.commit()
-
-        cursor.close()
-        dbConnection.commit()
-        dbConnection.close()
+        if failures:
+            print("Failed to make {} tiles of {}:".format(len(failures), region['name']))
+            for ((zoom, x, y), message) in failures:
+                print("  {}/{}/{}: {}".format(zoom, x, y, message))
+            os.remove(tmpFileName)
+            failedRegions.append(region['name'])
+            continue
 
         os.makedirs("out/"+region['continent'], exist_ok=True)
         os.rename(tmpFileName, fileName)
+
+    if failedRegions:
+        print("Incomplete regions, not written: {}".format(', '.join(failedRegions)))
+        exit(-1)
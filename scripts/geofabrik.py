@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+
+"""
+geofabrik
+=======================================================================================================
+
+Cached downloads of openstreetmap PBF files from Geofabrik.
+
+The continent files are tens of gigabytes. They are therefore kept in a cache
+directory, together with a small JSON file that records the ETag and the
+Last-Modified date sent by the server. On later runs, the file is requested
+conditionally and downloaded again only if Geofabrik has published a new
+version. Interrupted downloads are resumed, and every completed download is
+verified against the MD5 checksum that Geofabrik publishes next to each file.
+
+Files filtered by 'osmium tags-filter' are cached as well, keyed by the
+version of the source file and by the filter expressions.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import requests
+import subprocess
+
+
+cacheDirectory = 'cache/osm'
+chunkSize = 1024*1024
+
+
+def readInfo(fileName):
+    """Read the JSON file that describes a cached file
+
+    :param fileName: Name of the cached file
+
+    :returns: dict, empty if no description exists
+    """
+    try:
+        with open(fileName+'.json') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def writeInfo(fileName, info):
+    """Write the JSON file that describes a cached file
+
+    :param fileName: Name of the cached file
+
+    :param info: dict
+    """
+    with open(fileName+'.json.tmp', 'w') as file:
+        json.dump(info, file, indent=4)
+    os.replace(fileName+'.json.tmp', fileName+'.json')
+
+
+def fileMD5(fileName):
+    """Compute the MD5 checksum of a file
+
+    :param fileName: Name of the file
+
+    :returns: Hex string
+    """
+    md5 = hashlib.md5()
+    with open(fileName, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunkSize), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def publishedMD5(url):
+    """Download the MD5 checksum that Geofabrik publishes for a file
+
+    :param url: URL of the file
+
+    :returns: Hex string
+    """
+    response = requests.get(url+'.md5', timeout=60)
+    response.raise_for_status()
+    return response.text.split()[0].lower()
+
+
+def removePartialDownload(partFileName):
+    """Remove a partial download and its description
+
+    :param partFileName: Name of the partial download
+    """
+    for name in [partFileName, partFileName+'.json']:
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def promotePartialDownload(partFileName, fileName, info):
+    """Move a complete, verified download into place
+
+    :param partFileName: Name of the partial download
+
+    :param fileName: Name of the cached file
+
+    :param info: dict that identifies the version of the file
+    """
+    os.replace(partFileName, fileName)
+    writeInfo(fileName, info)
+    os.remove(partFileName+'.json')
+
+
+def download(url, refresh=True):
+    """Download a file into the cache, unless the cached copy is current
+
+    :param url: URL of the file
+
+    :param refresh: If False, a cached copy is used without asking the server
+        whether a newer version exists
+
+    :returns: Pair (name of the cached file, dict with the entries 'etag' and
+        'lastModified' that identify the version of the file)
+    """
+    os.makedirs(cacheDirectory, exist_ok=True)
+    fileName = os.path.join(cacheDirectory, os.path.basename(url))
+    partFileName = fileName+'.part'
+    info = readInfo(fileName)
+
+    if os.path.exists(fileName) and info and not refresh:
+        return (fileName, info)
+
+    try:
+        # Ask for the file, unless the cached copy is current
+        headers = {}
+        if os.path.exists(fileName) and info:
+            if info.get('etag'):
+                headers['If-None-Match'] = info['etag']
+            if info.get('lastModified'):
+                headers['If-Modified-Since'] = info['lastModified']
+
+        # A partial download may be complete already, if an earlier run
+        # stopped before it could verify and promote the file
+        partInfo = readInfo(partFileName)
+        validator = partInfo.get('etag') or partInfo.get('lastModified')
+        if os.path.exists(partFileName) and validator:
+            expectedMD5 = publishedMD5(url)
+            if fileMD5(partFileName) == expectedMD5:
+                print('Use completed download of {}'.format(url))
+                promotePartialDownload(partFileName, fileName, partInfo)
+                return (fileName, partInfo)
+
+        # Resume a partial download, provided that it belongs to the same
+        # version of the file. If-Range makes the server send the whole file
+        # if the version has changed in the meantime.
+        resumeFrom = 0
+        if os.path.exists(partFileName) and validator:
+            resumeFrom = os.path.getsize(partFileName)
+            headers['Range'] = 'bytes={}-'.format(resumeFrom)
+            headers['If-Range'] = validator
+
+        response = requests.get(url, headers=headers, stream=True, timeout=60)
+        if response.status_code == 416:
+            # The partial download cannot be resumed, start from zero
+            print('Cannot resume download of {}, restart'.format(url))
+            response.close()
+            removePartialDownload(partFileName)
+            headers.pop('Range', None)
+            headers.pop('If-Range', None)
+            response = requests.get(url, headers=headers, stream=True, timeout=60)
+
+        with response:
+            if response.status_code == 304:
+                print('Cached copy of {} is current'.format(url))
+                return (fileName, info)
+            response.raise_for_status()
+
+            newInfo = {
+                'etag': response.headers.get('ETag'),
+                'lastModified': response.headers.get('Last-Modified')
+            }
+            if response.status_code == 206:
+                print('Resume download of {} at {} bytes'.format(url, resumeFrom))
+                newInfo = partInfo
+                mode = 'ab'
+            else:
+                print('Download {}'.format(url))
+                mode = 'wb'
+            writeInfo(partFileName, newInfo)
+            with open(partFileName, mode) as file:
+                for chunk in response.iter_content(chunk_size=chunkSize):
+                    file.write(chunk)
+
+        expectedMD5 = publishedMD5(url)
+    except requests.exceptions.RequestException as err:
+        print("Error downloading " + url)
+        print(err)
+        exit(-1)
+
+    if fileMD5(partFileName) != expectedMD5:
+        print("Error downloading " + url + ": checksum mismatch")
+        removePartialDownload(partFileName)
+        exit(-1)
+
+    promotePartialDownload(partFileName, fileName, newInfo)
+    return (fileName, newInfo)
+
+
+def filteredPBF(url, filterExpressions, refresh=True):
+    """Download a PBF file and filter it with 'osmium tags-filter', using
+    cached results where possible
+
+    The filtered file is cached under a name that contains a hash of the
+    version of the source file and of the filter expressions. Other filtered
+    files of the same source are removed, so that the cache holds at most one
+    filtered file per source.
+
+    :param url: URL of the PBF file
+
+    :param filterExpressions: List of filter expressions, as understood by
+        'osmium tags-filter'
+
+    :param refresh: See download
+
+    :returns: Name of the filtered file
+    """
+    (sourceFileName, info) = download(url, refresh)
+
+    key = hashlib.sha256(json.dumps([info.get('etag'), info.get('lastModified'), filterExpressions]).encode()).hexdigest()[:16]
+    baseName = sourceFileName[:-len('.osm.pbf')] if sourceFileName.endswith('.osm.pbf') else sourceFileName
+    fileName = '{}-filtered-{}.osm.pbf'.format(baseName, key)
+    if os.path.exists(fileName):
+        print('Use cached filtered file {}'.format(fileName))
+        return fileName
+
+    print('Run Osmium tags-filter on {}'.format(sourceFileName))
+    subprocess.run(
+        ["osmium", "tags-filter", sourceFileName] + filterExpressions +
+        ["-o", fileName+'.tmp', "-f", "pbf", "--overwrite"],
+        check=True
+    )
+    os.replace(fileName+'.tmp', fileName)
+
+    for staleFileName in glob.glob(glob.escape(baseName)+'-filtered-*.osm.pbf'):
+        if staleFileName != fileName:
+            os.remove(staleFileName)
+    return fileName
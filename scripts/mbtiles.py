@@ -0,0 +1,618 @@
+#!/bin/python3
+
+"""
+mbtiles
+=======================================================================================================
+
+Toolset to manipulate files in the MBTiles format, as described here:
+https://github.com/mapbox/mbtiles-spec/blob/master/1.3/spec.md
+
+Besides the flat layout, where every tile is stored in the table 'tiles', the
+module supports a deduplicated layout. There, the table 'images' stores every
+distinct tile blob once, keyed by a hash of its content, and the table 'map'
+maps tile coordinates to these keys. A view named 'tiles' joins both tables,
+so that readers that only query 'tiles' work with either layout. Large areas
+of open ocean or uniform terrain consist of identical tiles, which are then
+stored only once.
+"""
+
+import argparse
+import hashlib
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def tileHash(data):
+    """Compute the key under which a tile blob is stored in the deduplicated
+    layout
+
+    :param data: Tile blob
+
+    :returns: Hex string
+    """
+    return hashlib.md5(data).hexdigest()
+
+
+def isDeduplicated(connection):
+    """Check if an mbtiles file uses the deduplicated layout
+
+    :param connection: sqlite3 connection to the mbtiles file
+
+    :returns: True if 'tiles' is a view
+    """
+    row = connection.execute("SELECT type FROM sqlite_master WHERE name='tiles'").fetchone()
+    return row is not None and row[0] == 'view'
+
+
+def createDeduplicatedTables(connection):
+    """Create the tables 'map' and 'images', and the view 'tiles'
+
+    The unique index on 'map' is not created, so that it can be built after
+    all tiles have been inserted. Use createDeduplicatedIndex for that.
+
+    :param connection: sqlite3 connection to the mbtiles file
+    """
+    connection.execute("CREATE TABLE map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT)")
+    connection.execute("CREATE TABLE images (tile_id TEXT PRIMARY KEY, tile_data BLOB)")
+    connection.execute("CREATE VIEW tiles AS SELECT "
+                       "map.zoom_level AS zoom_level, "
+                       "map.tile_column AS tile_column, "
+                       "map.tile_row AS tile_row, "
+                       "images.tile_data AS tile_data "
+                       "FROM map JOIN images ON images.tile_id = map.tile_id")
+
+
+def createDeduplicatedIndex(connection):
+    """Create the unique index on the table 'map'
+
+    :param connection: sqlite3 connection to the mbtiles file
+    """
+    connection.execute("CREATE UNIQUE INDEX map_index ON map (zoom_level, tile_column, tile_row)")
+
+
+def printDeduplicationRatio(conn, numTiles, sizeBefore):
+    """Print how much space deduplication saves in an mbtiles file
+
+    :param conn: sqlite3 connection to a deduplicated mbtiles file
+
+    :param numTiles: Number of tiles in the file
+
+    :param sizeBefore: Total size of the tiles, counted once per tile
+
+    :returns: Number of distinct blobs
+    """
+    (numImages, sizeAfter) = conn.execute("SELECT COUNT(*), TOTAL(LENGTH(tile_data)) FROM images").fetchone()
+    print("Deduplication: {} tiles stored as {} distinct blobs ({:.1f}% of tiles, {:.1f}% of tile bytes)".format(
+        numTiles, numImages,
+        100.0*numImages/max(numTiles, 1),
+        100.0*sizeAfter/max(sizeBefore, 1)))
+    return numImages
+
+
+def deduplicate(filename, batchSize=10000):
+    """Convert an mbtiles file from the flat into the deduplicated layout
+
+    The file is modified in-place and compactified afterwards. Files that
+    already use the deduplicated layout are left alone.
+
+    :param filename: mbtiles file
+
+    :param batchSize: Number of tiles inserted per executemany call
+
+    :returns: Pair (number of tiles, number of distinct tile blobs)
+    """
+    conn = sqlite3.connect(filename)
+    if isDeduplicated(conn):
+        numTiles = conn.execute("SELECT COUNT(*) FROM map").fetchone()[0]
+        numImages = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        conn.close()
+        return (numTiles, numImages)
+
+    conn.execute("ALTER TABLE tiles RENAME TO flat_tiles")
+    createDeduplicatedTables(conn)
+
+    numTiles = 0
+    sizeBefore = 0
+    mapRows = []
+    imageRows = []
+    readCursor = conn.cursor()
+    for (z, x, y, data) in readCursor.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM flat_tiles"):
+        key = tileHash(data)
+        mapRows.append( (z, x, y, key) )
+        imageRows.append( (key, data) )
+        numTiles += 1
+        sizeBefore += len(data)
+        if len(mapRows) >= batchSize:
+            conn.executemany("INSERT INTO map VALUES (?,?,?,?)", mapRows)
+            conn.executemany("INSERT OR IGNORE INTO images VALUES (?,?)", imageRows)
+            mapRows = []
+            imageRows = []
+    conn.executemany("INSERT INTO map VALUES (?,?,?,?)", mapRows)
+    conn.executemany("INSERT OR IGNORE INTO images VALUES (?,?)", imageRows)
+
+    conn.execute("DROP TABLE flat_tiles")
+    createDeduplicatedIndex(conn)
+    conn.commit()
+
+    numImages = printDeduplicationRatio(conn, numTiles, sizeBefore)
+
+    print("Compactifying database")
+    conn.execute("vacuum")
+    conn.close()
+    return (numTiles, numImages)
+
+
+#
+# High-throughput storage
+#
+# Tiles are written by a single thread, fed through a bounded queue, which
+# inserts them with executemany in large transactions. Indices are built once
+# all tiles are written. The pragmas set by 'connect' trade durability for
+# speed: our scripts write their output files from scratch, and a crashed run
+# is simply repeated. The larger page size reduces the number of overflow
+# pages for tile blobs, which are typically several kilobytes large.
+#
+
+pageSize = 16384
+mmapSize = 256*1024*1024
+cacheSize = -256*1024
+
+
+def connect(filename, mode="read"):
+    """Open an mbtiles file with tuned pragmas
+
+    :param filename: mbtiles file
+
+    :param mode: One of "read", "create" or "update". In mode "create", the
+        file must be new or empty. It is set up for fast bulk writing, without
+        journal. In mode "update", the journal mode is switched to WAL, so that
+        other connections can read while tiles are written. The file may hold
+        data that cannot be recreated, so synchronization is kept at NORMAL,
+        which is safe against corruption in WAL mode. In both writing modes,
+        call finishWriting before the file is shipped.
+
+    :returns: sqlite3 connection
+    """
+    connection = sqlite3.connect(filename, check_same_thread=False)
+    connection.execute("PRAGMA mmap_size={}".format(mmapSize))
+    connection.execute("PRAGMA cache_size={}".format(cacheSize))
+    if mode == "create":
+        connection.execute("PRAGMA page_size={}".format(pageSize))
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+    elif mode == "update":
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def finishWriting(connection):
+    """Commit and switch to the default journal mode, so that the mbtiles file
+    can be shipped as a single file
+
+    :param connection: sqlite3 connection to the mbtiles file
+    """
+    connection.commit()
+    connection.execute("PRAGMA journal_mode=DELETE")
+
+
+def createTables(connection, deduplicate=False):
+    """Create the tables of an empty mbtiles file, without tile indices
+
+    :param connection: sqlite3 connection to the mbtiles file
+
+    :param deduplicate: If True, use the deduplicated layout
+    """
+    connection.execute("CREATE TABLE metadata (name text, value text)")
+    connection.execute("CREATE UNIQUE INDEX name on metadata (name)")
+    if deduplicate:
+        createDeduplicatedTables(connection)
+    else:
+        connection.execute("CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)")
+
+
+def createIndex(connection):
+    """Create the unique tile index of an mbtiles file
+
+    :param connection: sqlite3 connection to the mbtiles file
+    """
+    if isDeduplicated(connection):
+        createDeduplicatedIndex(connection)
+    else:
+        connection.execute("CREATE UNIQUE INDEX tile_index on tiles (zoom_level, tile_column, tile_row)")
+
+
+def writeMetadata(connection, metadata):
+    """Write entries into the metadata table, replacing existing ones
+
+    :param connection: sqlite3 connection to the mbtiles file
+
+    :param metadata: Dictionary mapping names to values
+    """
+    connection.execute("DELETE FROM metadata WHERE name IN ({})".format(",".join("?"*len(metadata))), list(metadata))
+    connection.executemany("INSERT INTO metadata (name, value) VALUES (?, ?)",
+                           [(name, str(value)) for (name, value) in metadata.items()])
+
+
+def readMetadata(filename):
+    """Read the metadata table of an mbtiles file
+
+    :param filename: mbtiles file
+
+    :returns: Dictionary mapping names to values
+    """
+    connection = connect(filename)
+    metadata = dict(connection.execute("SELECT name, value FROM metadata"))
+    connection.close()
+    return metadata
+
+
+def readTileKeys(filename):
+    """Read the coordinates of all tiles in an mbtiles file
+
+    :param filename: mbtiles file
+
+    :returns: List of triples (zoom_level, tile_column, tile_row), in key order
+    """
+    connection = connect(filename)
+    keys = connection.execute("SELECT zoom_level, tile_column, tile_row FROM tiles "
+                              "ORDER BY zoom_level, tile_column, tile_row").fetchall()
+    connection.close()
+    return keys
+
+
+def readTiles(filename, ordered=False):
+    """Stream all tiles of an mbtiles file
+
+    The tiles are read through a separate connection, which is closed once
+    the generator is exhausted or discarded. The generator can therefore be
+    consumed by any one thread.
+
+    :param filename: mbtiles file
+
+    :param ordered: If True, the tiles are returned in key order
+
+    :returns: Generator of quadruples (zoom_level, tile_column, tile_row,
+        tile_data)
+    """
+    connection = connect(filename)
+    query = "SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles"
+    if ordered:
+        query += " ORDER BY zoom_level, tile_column, tile_row"
+    try:
+        yield from connection.execute(query)
+    finally:
+        connection.close()
+
+
+def copyTiles(sourceFileName, targetFileName, exclude=(), metadata=None, deduplicate=False):
+    """Copy an mbtiles file into a new file, leaving out some tiles
+
+    The tiles are streamed in key order into a freshly created file, whose
+    index is built at the end. The result is compact without VACUUM.
+
+    :param sourceFileName: mbtiles file that is read
+
+    :param targetFileName: mbtiles file that is written. An existing file of
+        that name is overwritten.
+
+    :param exclude: Set of triples (zoom_level, tile_column, tile_row) that
+        are not copied
+
+    :param metadata: Dictionary with metadata entries that replace entries of
+        the source file
+
+    :param deduplicate: If True, write the deduplicated layout
+
+    :returns: Number of tiles copied
+    """
+    newMetadata = readMetadata(sourceFileName)
+    newMetadata.update(metadata or {})
+    with MBTilesWriter(targetFileName, newMetadata, deduplicate=deduplicate) as writer:
+        batch = []
+        for row in readTiles(sourceFileName, ordered=True):
+            if row[:3] in exclude:
+                continue
+            batch.append(row)
+            if len(batch) >= 1000:
+                writer.putMany(batch)
+                batch = []
+        writer.putMany(batch)
+    return writer.numTiles
+
+
+def sliceTiles(sourceFileName, targetFileName, keys, metadata=None, deduplicate=False):
+    """Copy a subset of the tiles of an mbtiles file into a new file
+
+    The coordinates of the wanted tiles are loaded into a temporary table.
+    The source file is attached to the new file, and the tiles are copied by
+    a few INSERT ... SELECT statements that join the source with that table.
+    No tile blob passes through Python, unless a flat source is copied into
+    the deduplicated layout, where every blob must be hashed.
+
+    :param sourceFileName: mbtiles file that is read, in either layout
+
+    :param targetFileName: mbtiles file that is written. An existing file of
+        that name is overwritten.
+
+    :param keys: Iterable of triples (zoom_level, tile_column, tile_row) of
+        the tiles that are copied. Tiles missing in the source are ignored.
+
+    :param metadata: Dictionary with metadata entries that replace entries of
+        the source file
+
+    :param deduplicate: If True, write the deduplicated layout
+
+    :returns: Number of tiles copied
+    """
+    if os.path.exists(targetFileName):
+        os.remove(targetFileName)
+    connection = connect(targetFileName, "create")
+    createTables(connection, deduplicate)
+    connection.execute("ATTACH DATABASE ? AS source", (sourceFileName,))
+    sourceDeduplicated = connection.execute(
+        "SELECT type FROM source.sqlite_master WHERE name='tiles'").fetchone()[0] == 'view'
+
+    connection.execute("CREATE TEMP TABLE coverage (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, "
+                       "PRIMARY KEY (zoom_level, tile_column, tile_row)) WITHOUT ROWID")
+    connection.executemany("INSERT OR IGNORE INTO coverage VALUES (?,?,?)", keys)
+
+    connection.execute("INSERT INTO main.metadata SELECT name, value FROM source.metadata")
+    if metadata:
+        writeMetadata(connection, metadata)
+
+    join = "JOIN temp.coverage USING (zoom_level, tile_column, tile_row) ORDER BY zoom_level, tile_column, tile_row"
+    if not deduplicate:
+        connection.execute("INSERT INTO main.tiles SELECT zoom_level, tile_column, tile_row, tile_data "
+                           "FROM source.tiles " + join)
+    elif sourceDeduplicated:
+        connection.execute("INSERT INTO main.map SELECT zoom_level, tile_column, tile_row, tile_id "
+                           "FROM source.map " + join)
+        connection.execute("INSERT INTO main.images SELECT tile_id, tile_data FROM source.images "
+                           "WHERE tile_id IN (SELECT tile_id FROM main.map)")
+    else:
+        connection.create_function("tileHash", 1, tileHash, deterministic=True)
+        connection.execute("INSERT INTO main.map SELECT zoom_level, tile_column, tile_row, tileHash(tile_data) "
+                           "FROM source.tiles " + join)
+        connection.execute("INSERT OR IGNORE INTO main.images SELECT tileHash(tile_data), tile_data "
+                           "FROM source.tiles " + join)
+    numTiles = connection.execute("SELECT count(*) FROM main.{}".format("map" if deduplicate else "tiles")).fetchone()[0]
+    connection.commit()
+    connection.execute("DETACH DATABASE source")
+
+    createIndex(connection)
+    finishWriting(connection)
+    connection.close()
+    return numTiles
+
+
+class MBTilesWriter:
+    """Write tiles into an mbtiles file from a dedicated thread
+
+    Tiles handed to 'put' are queued and written by a single writer thread,
+    which inserts them with executemany, committing once per batch. The queue
+    is bounded, so that producers slow down if the disk cannot keep up. The
+    method 'put' can be called from any thread.
+
+    By default, a new file is created, and the tile index is built when the
+    writer is closed. With append=True, tiles are inserted into an existing
+    file in the flat layout, replacing tiles with the same coordinates. With
+    deduplicate=True, the writer prints how much space deduplication saved
+    when it is closed, like 'deduplicate'.
+
+    The writer can be used as a context manager, which closes it on exit.
+    """
+
+    def __init__(self, filename, metadata=None, deduplicate=False, append=False, batchSize=10000, queueSize=50000):
+        """
+        :param filename: mbtiles file. Unless append is True, an existing file
+            of that name is overwritten.
+
+        :param metadata: Dictionary with metadata entries
+
+        :param deduplicate: If True, use the deduplicated layout. Not
+            supported together with append.
+
+        :param append: If True, insert into an existing file
+
+        :param batchSize: Number of tiles written per transaction
+
+        :param queueSize: Maximal number of tiles waiting to be written
+        """
+        if deduplicate and append:
+            raise ValueError("MBTilesWriter cannot append to deduplicated files")
+        if not append and os.path.exists(filename):
+            os.remove(filename)
+
+        self.filename = filename
+        self.deduplicate = deduplicate
+        self.append = append
+        self.batchSize = batchSize
+        self.numTiles = 0
+        self.numBytes = 0
+        self.error = None
+        self.queue = queue.Queue(queueSize)
+        if metadata:
+            self.queue.put( ("metadata", metadata) )
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def put(self, z, x, y, data):
+        """Queue a tile for writing
+
+        :param z: zoom_level
+
+        :param x: tile_column
+
+        :param y: tile_row, in the TMS numbering used by mbtiles
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put( ("tile", (z, x, y, data)) )
+
+    def putMany(self, tiles):
+        """Queue several tiles for writing, with less overhead than 'put'
+
+        :param tiles: List of quadruples (zoom_level, tile_column, tile_row,
+            tile_data), with tile_row in the TMS numbering used by mbtiles
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put( ("tiles", tiles) )
+
+    def setMetadata(self, metadata):
+        """Queue metadata entries for writing
+
+        :param metadata: Dictionary mapping names to values
+        """
+        self.queue.put( ("metadata", metadata) )
+
+    def flush(self):
+        """Wait until all tiles queued so far are written and committed"""
+        done = threading.Event()
+        self.queue.put( ("flush", done) )
+        done.wait()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """Write all queued tiles, build the index and close the file"""
+        if self.thread is None:
+            return
+        self.queue.put( ("close", None) )
+        self.thread.join()
+        self.thread = None
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        """Body of the writer thread"""
+        connection = None
+        batch = []
+
+        def writeBatch():
+            if self.deduplicate:
+                keys = [tileHash(data) for (z, x, y, data) in batch]
+                connection.executemany("INSERT INTO map VALUES (?,?,?,?)",
+                                       [(z, x, y, key) for ((z, x, y, data), key) in zip(batch, keys)])
+                connection.executemany("INSERT OR IGNORE INTO images VALUES (?,?)",
+                                       [(key, data) for ((z, x, y, data), key) in zip(batch, keys)])
+            elif self.append:
+                connection.executemany("INSERT OR REPLACE INTO tiles VALUES (?,?,?,?)", batch)
+            else:
+                connection.executemany("INSERT INTO tiles VALUES (?,?,?,?)", batch)
+            connection.commit()
+            self.numTiles += len(batch)
+            self.numBytes += sum(len(data) for (z, x, y, data) in batch)
+            batch.clear()
+
+        while True:
+            (kind, item) = self.queue.get()
+            if self.error is not None:
+                # Keep draining the queue, so that producers do not block
+                if kind == "flush":
+                    item.set()
+                if kind == "close":
+                    break
+                continue
+            try:
+                if connection is None:
+                    connection = connect(self.filename, "update" if self.append else "create")
+                    if not self.append:
+                        createTables(connection, self.deduplicate)
+                if kind == "tile":
+                    batch.append(item)
+                    if len(batch) >= self.batchSize:
+                        writeBatch()
+                elif kind == "tiles":
+                    batch.extend(item)
+                    if len(batch) >= self.batchSize:
+                        writeBatch()
+                elif kind == "metadata":
+                    writeMetadata(connection, item)
+                elif kind == "flush":
+                    writeBatch()
+                    item.set()
+                elif kind == "close":
+                    writeBatch()
+                    if not self.append:
+                        createIndex(connection)
+                    finishWriting(connection)
+                    if self.deduplicate:
+                        printDeduplicationRatio(connection, self.numTiles, self.numBytes)
+                    break
+            except Exception as e:
+                self.error = e
+                if kind == "flush":
+                    item.set()
+                if kind == "close":
+                    break
+
+        if connection is not None:
+            connection.close()
+
+
+def benchmark(numTiles, tileSize, deduplicate=False):
+    """Measure the throughput of MBTilesWriter, compared to inserting tiles
+    one execute at a time
+
+    :param numTiles: Number of tiles written
+
+    :param tileSize: Size of the random tile blobs, in bytes
+
+    :param deduplicate: If True, use the deduplicated layout
+    """
+    blobs = [os.urandom(tileSize) for i in range(256)]
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "benchmark.mbtiles")
+
+        start = time.time()
+        connection = sqlite3.connect(filename)
+        connection.execute("CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)")
+        connection.execute("CREATE UNIQUE INDEX tile_index on tiles (zoom_level, tile_column, tile_row)")
+        for i in range(numTiles):
+            connection.execute("INSERT INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                               (10, i // 1024, i % 1024, blobs[i % 256]))
+        connection.commit()
+        connection.close()
+        naive = numTiles/(time.time()-start)
+        os.remove(filename)
+
+        start = time.time()
+        with MBTilesWriter(filename, deduplicate=deduplicate) as writer:
+            for i in range(numTiles):
+                writer.put(10, i // 1024, i % 1024, blobs[i % 256])
+        batched = numTiles/(time.time()-start)
+        os.remove(filename)
+
+        start = time.time()
+        with MBTilesWriter(filename, deduplicate=deduplicate) as writer:
+            for first in range(0, numTiles, 1000):
+                writer.putMany([(10, i // 1024, i % 1024, blobs[i % 256]) for i in range(first, min(first+1000, numTiles))])
+        batchedMany = numTiles/(time.time()-start)
+
+    print("Single inserts:          {:10.0f} tiles/second".format(naive))
+    print("MBTilesWriter.put:       {:10.0f} tiles/second".format(batched))
+    print("MBTilesWriter.putMany:   {:10.0f} tiles/second".format(batchedMany))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the insertion of tiles into mbtiles files")
+    parser.add_argument("--tiles", type=int, default=200000,
+                        help="Number of tiles (default: 200000)")
+    parser.add_argument("--size", type=int, default=20000,
+                        help="Tile size in bytes (default: 20000)")
+    parser.add_argument("--deduplicate", action="store_true",
+                        help="Use the deduplicated layout")
+    args = parser.parse_args()
+    benchmark(args.tiles, args.size, args.deduplicate)
@@ -2,7 +2,8 @@
 
 import geopandas
 import math
-import sqlite3
+import mbtiles
+import os
 
 from shapely.geometry import Polygon
 
@@ -59,18 +60,13 @@ def foreignTiles(tileList, countryName):
 
 country = 'Germany'
 
-dbConnection = sqlite3.connect('Germany.mbtiles')
-cursor = dbConnection.cursor()
-
-tileList = [(z,x,2**z-1-y) for (z,x,y) in cursor.execute('SELECT zoom_level, tile_column, tile_row FROM tiles')]
+tileList = [(z,x,2**z-1-y) for (z,x,y) in mbtiles.readTileKeys('Germany.mbtiles')]
 tilesToDelete = foreignTiles(tileList, country)
 
 for (z,x,y) in tilesToDelete:
     print(z,x,y)
-    cursor.execute('DELETE FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?', (z,x,2**z-1-y))
 
-dbConnection.commit()
-cursor.execute("vacuum")
-cursor.close()
-dbConnection.commit()
-dbConnection.close()
+# Write the remaining tiles into a new, compact file instead of deleting
+# tiles and running VACUUM
+mbtiles.copyTiles('Germany.mbtiles', 'Germany.mbtiles.tmp', {(z,x,2**z-1-y) for (z,x,y) in tilesToDelete})
+os.replace('Germany.mbtiles.tmp', 'Germany.mbtiles')
@@ -1,4 +1,6 @@
+import boundaries
 import geopandas
+import hashlib
 import json
 import os
 import sys
@@ -14,7 +16,26 @@ with open('worldAviationMap.geojson') as file:
 print('Splitting world aviation map {}'.format(infoString))
 
 
-worldCountryMap = geopandas.read_file( 'data/ne_10m_admin_0_countries/ne_10m_admin_0_countries.dbf' )
+#
+# The manifest stores, for every region, a hash of the features that have last
+# been deployed. Regions whose features are unchanged are not written again, so
+# that deploy-hetzner.py neither compresses nor uploads them. Delete the
+# manifest to force regeneration of all regions.
+#
+# New hashes go into a pending manifest, which deploy-hetzner.py promotes only
+# after a successful upload. If the deployment fails, the next run therefore
+# writes the changed regions again.
+#
+manifestFileName = 'aviationMapManifest.json'
+pendingManifestFileName = 'aviationMapManifest.pending.json'
+deployedManifest = {}
+if os.path.exists(manifestFileName):
+    with open(manifestFileName) as file:
+        deployedManifest = json.load(file)
+manifest = dict(deployedManifest)
+if os.path.exists(pendingManifestFileName):
+    # Left over from a run whose deployment failed
+    os.remove(pendingManifestFileName)
 
 myRegion = ""
 if len(sys.argv) > 1:
@@ -31,15 +52,30 @@ for region in myRegions:
 
     print('Generating map extract for ' + region["name"] )
 
-    buffer = regions.bufferedBoundary(region)
+    buffer = boundaries.bufferedBoundary(region)
     aviationMap = geopandas.read_file('worldAviationMap.geojson', mask=buffer)
 
     # Generate json
     jsonString = aviationMap.to_json(na='drop', drop_id=True)
     jsonDict = json.loads(jsonString)
+
+    # Compare the features with those of the last run. The info string is
+    # excluded from the hash because it changes with every run.
+    contentHash = hashlib.sha256(json.dumps(jsonDict['features'], sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+    manifestKey = region["continent"] + '/' + region["name"]
+    if deployedManifest.get(manifestKey) == contentHash:
+        print('… unchanged, skipping')
+        continue
+
     jsonDict['info'] = infoString
     jsonString = json.dumps(jsonDict, sort_keys=True, separators=(',', ':'))
 
     os.makedirs('out/' + region["continent"], exist_ok=True)
-    file = open('out/' + region["continent"] + '/' + region["name"] + '.geojson', 'w')
-    file.write(jsonString)
+    with open('out/' + region["continent"] + '/' + region["name"] + '.geojson', 'w') as file:
+        file.write(jsonString)
+
+    # Update the pending manifest only after the region file is complete
+    manifest[manifestKey] = contentHash
+    with open(pendingManifestFileName + '.tmp', 'w') as file:
+        json.dump(manifest, file, sort_keys=True, indent=4)
+    os.replace(pendingManifestFileName + '.tmp', pendingManifestFileName)
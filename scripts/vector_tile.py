@@ -8,30 +8,41 @@ Toolset to manipulate vector tiles, in the format described here:
 https://github.com/mapbox/vector-tile-spec/tree/master/2.1
 """
 
-import geopandas
+import boundaries
+import collections
+import functools
 import math
 import gzip
+import hashlib
+import heapq
+import json
+import mbtiles
+import multiprocessing
+import numpy
 import os
+import shapely
 import sqlite3
 import subprocess
+import threading
+import time
 import vector_tile_pb2
 
 from datetime import date
-from shapely.geometry import Polygon
 
 
 def num2lonlat(xtile, ytile, zoom):
     """
     This returns the NW-corner of the square. Use the function with xtile+1
     and/or ytile+1 to get the other corners. With xtile+0.5 & ytile+0.5 it will
-    return the center of the tile. 
+    return the center of the tile. The tile numbers can also be numpy arrays,
+    in which case arrays of coordinates are returned.
 
     https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames#Tile_numbers_to_lon./lat._2
     """
     n = 2.0 ** zoom
     lon_deg = xtile / n * 360.0 - 180.0
-    lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * ytile / n)))
-    lat_deg = math.degrees(lat_rad)
+    lat_rad = numpy.arctan(numpy.sinh(math.pi * (1 - 2 * ytile / n)))
+    lat_deg = numpy.degrees(lat_rad)
     return (lon_deg, lat_deg)
 
 
@@ -40,347 +51,1398 @@ def foreignTiles(tileList, countryName):
     This method takes a list of slippy map tilenames and the name of a country,
     and returns a list of those tiles that do not intersect the country.
 
+    The tiles are tested level by level, starting at the lowest zoom level that
+    appears in the list, with one bulk shapely operation per level. Tiles that
+    lie entirely inside or entirely outside of the country pass their verdict
+    on to all their descendants, which are then not tested at all. Only tiles
+    that cross the country boundary are subdivided.
+
     https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
     """
-    
-    result = []
 
-    # Generate buffered region around country
-    worldCountryMap = geopandas.read_file( 'data/ne_10m_admin_0_countries/ne_10m_admin_0_countries.dbf' )
-    countryGDF = worldCountryMap[worldCountryMap.SOVEREIGNT == countryName]
-    if countryGDF.size == 0:
-        print('Country is empty: '+countryName)
-        exit(-1)
-    countryGDF.set_crs("EPSG:4326")
-    buffer = countryGDF.to_crs(crs=3857).buffer(20000).to_crs(crs=4326) # countryGDF.buffer(0.3).set_crs("EPSG:4326")
+    if len(tileList) == 0:
+        return []
 
+    # Generate buffered region around country
+    buffer = shapely.union_all(list(boundaries.bufferedCountry(countryName)))
+    shapely.prepare(buffer)
+
+    # For every zoom level, find the tiles that are either in the list or
+    # ancestors of tiles in the list
+    zoomMin = min(z for (z,x,y) in tileList)
+    zoomMax = max(z for (z,x,y) in tileList)
+    relevant = {zoom: set() for zoom in range(zoomMin, zoomMax+1)}
     for (z,x,y) in tileList:
-        p = Polygon([num2lonlat(x,y,z), num2lonlat(x+1,y,z), num2lonlat(x+1,y+1,z), num2lonlat(x,y+1,z)])
-        intersectionVector = buffer.intersects(p)
-        if True not in intersectionVector.values:
-            result.append( (z,x,y) )
-    return result
+        while z >= zoomMin and (x,y) not in relevant[z]:
+            relevant[z].add( (x,y) )
+            (z,x,y) = (z-1, x//2, y//2)
+
+    # Walk down the quadtree. 'verdicts' holds the tiles whose intersection
+    # status has been computed, 'candidates' the tiles that still need testing.
+    verdicts = {}
+    candidates = relevant[zoomMin]
+    for zoom in range(zoomMin, zoomMax+1):
+        if len(candidates) == 0:
+            break
+        tiles = list(candidates)
+        xs = numpy.array([x for (x,y) in tiles], dtype=numpy.float64)
+        ys = numpy.array([y for (x,y) in tiles], dtype=numpy.float64)
+        (west, north) = num2lonlat(xs, ys, zoom)
+        (east, south) = num2lonlat(xs+1, ys+1, zoom)
+        boxes = shapely.box(west, south, east, north)
+        intersects = shapely.intersects(buffer, boxes)
+        inside = shapely.contains_properly(buffer, boxes)
+
+        boundaryTiles = []
+        for ((x,y), i, c) in zip(tiles, intersects, inside):
+            verdicts[(zoom,x,y)] = bool(i)
+            if i and not c:
+                boundaryTiles.append( (x,y) )
+
+        if zoom < zoomMax:
+            candidates = relevant[zoom+1].intersection(
+                (2*x+dx, 2*y+dy) for (x,y) in boundaryTiles for dx in (0,1) for dy in (0,1)
+            )
+
+    # Every tile inherits the verdict of its closest tested ancestor
+    def intersectsCountry(z, x, y):
+        while (z,x,y) not in verdicts:
+            (z,x,y) = (z-1, x//2, y//2)
+        return verdicts[(z,x,y)]
+
+    return [tile for tile in tileList if not intersectsCountry(*tile)]
+
+
+#
+# Optimization rules for the layers of the OpenMapTiles schema, as produced by
+# tilemaker/process.lua.
+#
+# Layers listed in 'droppedLayers' are removed from every tile. Every other
+# layer must have an entry in 'layerRules'. An entry can contain the following
+# rules, which are applied in the order given here.
+#
+#   keepFeatures: Pair (key name, list of values). Only features whose value
+#       for the key is contained in the list are kept.
+#
+#   topFeatures: Pair (key name, number n). Only the n features with the
+#       largest numerical values for the key are kept, in descending order.
+#       Features without the key count as -1.
+#
+#   minPolygonArea: Dictionary mapping zoom levels to areas, measured in
+#       square pixels of a tile rendered at 'tilePixels' pixels. At these zoom
+#       levels, polygons and inner rings with a smaller area are removed, and
+#       features that lose all their polygons are removed as well. At other
+#       zoom levels, and if the zoom level is unknown, the rule does nothing.
+#       The rule can be switched off with the argument keepTinyPolygons of
+#       the optimization functions.
+#
+#   keepTags: List of key names. All tags with other keys are removed.
+#
+#   mergeFeatures: Dictionary mapping zoom levels to one of the methods
+#       "concatenate" and "union". At these zoom levels, features of the same
+#       geometry type with identical tags are merged into one feature with a
+#       multi-geometry, which takes the place of the first of them. With
+#       "union", the polygons are united as well, so that touching polygons
+#       become one.
+#
+# Unused keys and values are removed from the layer dictionaries of all layers
+# with a non-empty rule. Layers with an empty rule are copied unchanged, unless
+# they are re-quantized.
+#
+# At the zoom levels listed in 'zoomExtents', the geometries of all layers are
+# re-quantized to the given extent, if their extent is larger. Vertices that
+# fall onto the same point are merged, and rings and lines that degenerate are
+# removed. At these zoom levels, the default extent of 4096 is much finer than
+# a pixel, and the smaller coordinates compress better.
+#
+
+tilePixels = 512
+
+zoomExtents = {
+    6: 512,
+    7: 1024,
+    8: 1024
+}
+
+droppedLayers = [
+    "aerodrome_label",
+    "building",
+    "housenumber",
+    "park",
+    "poi"
+]
+
+layerRules = {
+    "aeroway": {},
+    "boundary": {
+        "keepFeatures": ("admin_level", [2.0]),
+        "keepTags": ["admin_level"]
+    },
+    "landcover": {
+        "keepTags": ["class"],
+        "minPolygonArea": {6: 1.0, 7: 1.0, 8: 1.0, 9: 1.0},
+        "mergeFeatures": {6: "union", 7: "union", 8: "union", 9: "concatenate", 10: "concatenate"}
+    },
+    "landuse": {
+        "keepTags": ["class"],
+        "minPolygonArea": {6: 1.0, 7: 1.0, 8: 1.0, 9: 1.0},
+        "mergeFeatures": {6: "union", 7: "union", 8: "union", 9: "concatenate", 10: "concatenate"}
+    },
+    "mountain_peak": {
+        "topFeatures": ("ele", 5),
+        "keepTags": ["class", "name_en"]
+    },
+    "place": {
+        "keepFeatures": ("class", ["city", "town", "village"]),
+        "keepTags": ["class", "name", "name_en"]
+    },
+    "transportation": {
+        "keepFeatures": ("class", ["aerialway", "motorway", "trunk", "primary", "secondary", "rail"]),
+        "keepTags": ["class", "subclass", "network"],
+        "mergeFeatures": {6: "concatenate", 7: "concatenate", 8: "concatenate", 9: "concatenate", 10: "concatenate"}
+    },
+    "transportation_name": {
+        "keepFeatures": ("class", ["motorway", "trunk", "primary"]),
+        "keepTags": ["class", "name", "name_en", "network", "ref", "ref_length"]
+    },
+    "water": {
+        "keepFeatures": ("class", ["river", "lake", "ocean"]),
+        "keepTags": ["class"],
+        "minPolygonArea": {6: 1.0, 7: 1.0, 8: 1.0, 9: 1.0},
+        "mergeFeatures": {6: "union", 7: "union", 8: "union", 9: "concatenate", 10: "concatenate"}
+    },
+    "water_name": {
+        "keepTags": ["class", "name", "name_en"]
+    },
+    "waterway": {
+        "keepFeatures": ("class", ["stream", "river", "canal"]),
+        "keepTags": ["class", "name", "name_en"]
+    }
+}
+
+
+def compileLayerRules(rules):
+    """Convert the lists in a rule table into sets, for fast lookup
+
+    :param rules: Rule table, in the format of 'layerRules'
+
+    :returns: Rule table of the same format, with lists replaced by frozensets
+    """
+    compiledRules = {}
+    for (layerName, rule) in rules.items():
+        compiledRule = {}
+        if "keepFeatures" in rule:
+            (keyName, values) = rule["keepFeatures"]
+            compiledRule["keepFeatures"] = (keyName, frozenset(values))
+        if "topFeatures" in rule:
+            compiledRule["topFeatures"] = tuple(rule["topFeatures"])
+        if "keepTags" in rule:
+            compiledRule["keepTags"] = frozenset(rule["keepTags"])
+        if "minPolygonArea" in rule:
+            compiledRule["minPolygonArea"] = dict(rule["minPolygonArea"])
+        if "mergeFeatures" in rule:
+            compiledRule["mergeFeatures"] = dict(rule["mergeFeatures"])
+        compiledRules[layerName] = compiledRule
+    return compiledRules
+
+
+compiledLayerRules = compileLayerRules(layerRules)
+
+# Version of the optimization code. Increase this number whenever a change to
+# the code changes the optimized tiles, so that cached results are not reused.
+optimizationVersion = 2
+
+# Hash of everything that determines the result of optimizeTileData, used to
+# key the tile cache
+optimizationHash = hashlib.sha256(json.dumps(
+    [optimizationVersion, tilePixels, droppedLayers, layerRules, zoomExtents],
+    sort_keys=True
+).encode()).digest()
+
+
+def deleteItems(repeatedField, keep):
+    """Delete items from a repeated protobuf field, in place
+
+    Consecutive items are deleted with one slice operation, working from
+    the end of the field towards the beginning. Kept items are neither
+    copied nor moved to new message objects.
+
+    :param repeatedField: Repeated field, such as layer.features
+
+    :param keep: List of booleans, one for every item of the field
+    """
+    end = len(keep)
+    while end > 0:
+        if keep[end-1]:
+            end -= 1
+            continue
+        start = end-1
+        while start > 0 and not keep[start-1]:
+            start -= 1
+        del repeatedField[start:end]
+        end = start
+
+
+#
+# Geometry command streams, as described in section 4.3 of the vector tile
+# specification, https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+#
+# A geometry is decoded into a list of parts. For points, every part is a
+# single vertex. For line strings, every part is a line. For polygons, every
+# part is a ring, without the closing vertex. Vertices are lists [x, y] of
+# absolute tile coordinates.
+#
+
+def zigzagDecode(value):
+    """Decode a zigzag-encoded parameter integer
+
+    :param value: Non-negative integer
+
+    :returns: Integer
+    """
+    return (value >> 1) ^ -(value & 1)
 
 
-def optimizeVectorTiles(filename):
-    """Optimize an mbtiles file
+def zigzagEncode(value):
+    """Zigzag-encode a parameter integer
 
-    This method optimizes an mbtiles file, by removing data this is irrelevant
-    to enrouteFlightMap. It also lowers the number of mountain peaks, removing
-    all but the three highest peaks from each tile.running optimizeTile on
-    every tile.
+    :param value: Integer
 
-    The method also adds a few entries to the map file metadata.
+    :returns: Non-negative integer
+    """
+    return (value << 1) ^ (value >> 31)
+
+
+def decodeGeometry(geometry):
+    """Decode a geometry command stream
+
+    :param geometry: List of command and parameter integers, such as
+        feature.geometry
 
-    :param filename: mbtiles file. The file is modified in-place.
+    :returns: List of parts
     """
+    parts = []
+    x = 0
+    y = 0
+    i = 0
+    while i < len(geometry):
+        commandId = geometry[i] & 7
+        count = geometry[i] >> 3
+        i += 1
+        if commandId == 7:
+            continue
+        for j in range(count):
+            x += zigzagDecode(geometry[i])
+            y += zigzagDecode(geometry[i+1])
+            i += 2
+            if commandId == 1:
+                parts.append([[x, y]])
+            else:
+                parts[-1].append([x, y])
+    return parts
+
+
+def encodeGeometry(parts, geometryType):
+    """Encode a geometry command stream
+
+    :param parts: List of parts, as returned by decodeGeometry
+
+    :param geometryType: One of vector_tile_pb2.Tile.POINT, LINESTRING and
+        POLYGON
+
+    :returns: List of command and parameter integers
+    """
+    geometry = []
+    x = 0
+    y = 0
+
+    def lineTo(vertices):
+        nonlocal x, y
+        for (vx, vy) in vertices:
+            geometry.append(zigzagEncode(vx - x))
+            geometry.append(zigzagEncode(vy - y))
+            (x, y) = (vx, vy)
+
+    if geometryType == vector_tile_pb2.Tile.POINT:
+        if parts:
+            geometry.append((len(parts) << 3) | 1)
+            lineTo(part[0] for part in parts)
+        return geometry
+
+    for part in parts:
+        geometry.append((1 << 3) | 1)
+        lineTo(part[:1])
+        if len(part) > 1:
+            geometry.append(((len(part)-1) << 3) | 2)
+            lineTo(part[1:])
+        if geometryType == vector_tile_pb2.Tile.POLYGON:
+            geometry.append((1 << 3) | 7)
+    return geometry
+
+
+def ringArea(ring):
+    """Compute the signed area of a ring with the surveyor's formula
+
+    In tile coordinates, where y runs downwards, exterior rings have positive
+    area and interior rings negative area.
+
+    :param ring: List of vertices, without the closing vertex
+
+    :returns: Area, in square tile coordinate units
+    """
+    area = 0
+    (px, py) = ring[-1]
+    for (x, y) in ring:
+        area += px*y - x*py
+        (px, py) = (x, y)
+    return area/2
+
+
+def roundPolygon(rings, scale=1.0):
+    """Scale the rings of a polygon geometry and round them to integer
+    coordinates
 
-    def optimizeTile(tile):
-        """Optimize a tile
+    Repeated vertices are merged. Rings that lose their area or whose
+    orientation flips are removed. A polygon whose exterior ring is removed
+    loses its inner rings, too.
 
-        This method optimizes a tile, by removing data this is irrelevant to
-        enrouteFlightMap. It also lowers the number of mountain peaks, removing
-        all but the three highest peaks from each tile.
+    :param rings: List of rings, as returned by decodeGeometry. Coordinates
+        may be floats.
 
-        :param tile: Tile that is to be optimized. The tile is modified
+    :param scale: Factor applied to all coordinates before rounding
+
+    :returns: List of rings with integer coordinates
+    """
+    newRings = []
+    keepingPolygon = False
+    for ring in rings:
+        exterior = ringArea(ring) > 0
+        newRing = []
+        for (x, y) in ring:
+            vertex = [math.floor(x*scale + 0.5), math.floor(y*scale + 0.5)]
+            if not newRing or newRing[-1] != vertex:
+                newRing.append(vertex)
+        if len(newRing) > 1 and newRing[-1] == newRing[0]:
+            del newRing[-1]
+        newArea = ringArea(newRing) if len(newRing) >= 3 else 0
+        if exterior:
+            keepingPolygon = newArea > 0
+            if keepingPolygon:
+                newRings.append(newRing)
+        elif keepingPolygon and newArea < 0:
+            newRings.append(newRing)
+    return newRings
+
+
+def unitePolygons(rings):
+    """Unite the polygons of a polygon geometry, so that overlapping and
+    touching polygons become one
+
+    :param rings: List of rings, as returned by decodeGeometry
+
+    :returns: List of rings with integer coordinates, or None if the geometry
+        is invalid and cannot be united
+    """
+    polygons = []
+    for ring in rings:
+        if ringArea(ring) > 0:
+            polygons.append([ring])
+        elif polygons:
+            polygons[-1].append(ring)
+    try:
+        union = shapely.union_all([shapely.Polygon(polygon[0], polygon[1:]) for polygon in polygons])
+        # Remove the vertices where united polygons used to touch
+        union = shapely.simplify(union, 0)
+    except shapely.errors.GEOSException:
+        return None
+
+    newRings = []
+    for part in shapely.get_parts(union):
+        if not isinstance(part, shapely.Polygon) or part.is_empty:
+            continue
+        # Exterior rings must have positive area, see ringArea
+        part = shapely.geometry.polygon.orient(part, sign=1.0)
+        newRings.append(list(part.exterior.coords)[:-1])
+        newRings.extend(list(interior.coords)[:-1] for interior in part.interiors)
+    return roundPolygon(newRings)
+
+
+def requantizeLayer(layer, extent):
+    """Re-quantize the geometries of a layer to a smaller extent
+
+    Coordinates are scaled and rounded to the new grid. Repeated vertices are
+    merged. Lines with fewer than two vertices are removed, and polygons are
+    cleaned up as described at roundPolygon. Features without remaining
+    geometry are deleted.
+
+    :param layer: Layer that is to be re-quantized. The layer is modified
+        in-place.
+
+    :param extent: New extent. If the layer extent is not larger, the layer
+        is left unchanged.
+    """
+    if layer.extent <= extent:
+        return
+    scale = extent/layer.extent
+
+    def requantize(part):
+        newPart = []
+        for (x, y) in part:
+            vertex = [math.floor(x*scale + 0.5), math.floor(y*scale + 0.5)]
+            if not newPart or newPart[-1] != vertex:
+                newPart.append(vertex)
+        return newPart
+
+    keep = []
+    for feature in layer.features:
+        parts = decodeGeometry(feature.geometry)
+        if feature.type == vector_tile_pb2.Tile.POINT:
+            newParts = [requantize(part) for part in parts]
+        elif feature.type == vector_tile_pb2.Tile.LINESTRING:
+            newParts = [newPart for newPart in map(requantize, parts) if len(newPart) >= 2]
+        elif feature.type == vector_tile_pb2.Tile.POLYGON:
+            newParts = roundPolygon(parts, scale)
+        else:
+            keep.append(True)
+            continue
+        keep.append(len(newParts) > 0)
+        del feature.geometry[:]
+        feature.geometry.extend(encodeGeometry(newParts, feature.type))
+    deleteItems(layer.features, keep)
+    layer.extent = extent
+
+
+# Names of the optimization steps, in the order in which they are applied.
+# The optimization functions can record how many bytes each step saves, in a
+# dictionary that maps these names to numbers of bytes of the serialized,
+# uncompressed tiles.
+optimizationSteps = [
+    "droppedLayers",
+    "keepFeatures",
+    "topFeatures",
+    "minPolygonArea",
+    "requantize",
+    "keepTags",
+    "mergeFeatures"
+]
+
+
+def optimizeLayer(layer, rule, zoom=None, keepTinyPolygons=False, savings=None):
+    """Optimize a layer
+
+    This method applies a rule, in the format of 'compiledLayerRules', to a
+    layer and removes unused keys and values from the layer dictionaries.
+
+    :param layer: Layer that is to be optimized. The layer is modified
         in-place.
+
+    :param rule: Compiled rule
+
+    :param zoom: Zoom level of the tile, or None if unknown. Rules that
+        depend on the zoom level, and the re-quantization described at
+        'zoomExtents', are skipped if None.
+
+    :param keepTinyPolygons: If True, the rule minPolygonArea is skipped
+
+    :param savings: Dictionary, see 'optimizationSteps', or None. If given,
+        the bytes saved by each step are added to it.
+    """
+
+    def keyIndices(layer, keyNames):
+        """Find the indices of keys in the dictionary of a layer
+
+        :param layer: Layer
+
+        :param keyNames: Set of key names
+
+        :returns: Set of indices into layer.keys
         """
+        return {index for (index, key) in enumerate(layer.keys) if key in keyNames}
 
-        def getMetaData(feature, layer):
-            """Obtain meta data for a feature, as a convenient string-to-value
-            dictionary
+    def featureValue(feature, keys, values):
+        """Find the value of a feature for one of the given keys
 
-            :param feature: Feature whose meta data is to be read
+        :param feature: Feature
 
-            :param layer: Layer that contains the feature
+        :param keys: Set of indices into layer.keys
 
-            :returns: Meta data dictionary
-            """
-            metaData = {}
-            for i in range(0, len(feature.tags), 2):
-                key = layer.keys[feature.tags[i]]
-                val = feature.tags[i+1]
-                metaData[key] = layer.values[val]
-            return metaData
+        :param values: Dictionary, mapping indices into layer.values to
+            values
 
-        def optimizeLayer(layer):
-            """Delete unused keys and values from a layer
+        :returns: Value found in the dictionary, or None
+        """
+        tags = feature.tags
+        for i in range(0, len(tags), 2):
+            if tags[i] in keys:
+                return values.get(tags[i+1])
+        return None
 
-            :param layer: Layer that is to be optimized. The layer is modified
-            in-place.
-            """
-            keysInUse = []
-            valuesInUse = []
-            for feature in layer.features:
-                for i in range(0, len(feature.tags), 2):
-                    key = layer.keys[feature.tags[i]]
-                    if key not in keysInUse:
-                        keysInUse.append(key)
-                    feature.tags[i] = keysInUse.index(key)
-                    value = layer.values[feature.tags[i+1]]
-                    if value not in valuesInUse:
-                        valuesInUse.append(value)
-                    feature.tags[i+1] = valuesInUse.index(value)
-
-            del layer.keys[:]
-            layer.keys.extend(keysInUse)
-            del layer.values[:]
-            layer.values.extend(valuesInUse)
-
-        def removeLayers(tile, list):
-            """Deletes all layers from the tile whose names are contained in
-            the list.
-
-            :param tile: Tile whose layers are deleted
-
-            :param list: List of key layer names
-            """
-            newLayers = []
-            for layer in tile.layers:
-                if layer.name in list:
-                    continue
-                newLayer = vector_tile_pb2.Tile.Layer()
-                newLayer.CopyFrom(layer)
-                newLayers.append(newLayer)
-            del tile.layers[:]
-            tile.layers.extend(newLayers)
-
-        def restrictFeatures(layer, keyName, list):
-            """Delete all features from the layer, except features with meta
-            data where the value for the key name is contained in the list.
-
-            :param layer: Layer whose features are deleted
-
-            :param keyName: Name of key
-
-            :param list: List of values
-            """
-            newFeatures = []
-            for feature in layer.features:
-                metaData = getMetaData(feature, layer)
-                sVal = metaData[keyName].string_value
-                fVal = metaData[keyName].float_value
-                if (sVal not in list) and (fVal not in list):
-                    continue
-                newFeature = vector_tile_pb2.Tile.Feature()
-                newFeature.CopyFrom(feature)
-                newFeatures.append(newFeature)
-            del layer.features[:]
-            layer.features.extend(newFeatures)
-
-        def restrictTags(layer, list):
-            """Delete all tags from all features, except feature whose key
-            names are contained in the list.
-
-            :param layer: Layer whose features are deleted
-
-            :param list: List of key names
-            """
-            for feature in layer.features:
-                newTags = []
-                for i in range(0, len(feature.tags), 2):
-                    if layer.keys[feature.tags[i]] not in list:
-                        continue
-                    newTags.append(feature.tags[i])
-                    newTags.append(feature.tags[i+1])
-                del feature.tags[:]
-                feature.tags.extend(newTags)
-
-        removeLayers(tile, [
-            "aerodrome_label",
-            "building",
-            "housenumber",
-            "park",
-            "poi"
+    def restrictFeatures(layer, keyName, valueSet):
+        """Delete all features from the layer, except features with meta
+        data where the value for the key name is contained in the set.
+
+        :param layer: Layer whose features are deleted
+
+        :param keyName: Name of key
+
+        :param valueSet: Set of string or float values
+        """
+        keys = keyIndices(layer, {keyName})
+        matchingValues = {
+            index: True for (index, value) in enumerate(layer.values)
+            if (value.string_value in valueSet) or (value.float_value in valueSet)
+        }
+        deleteItems(layer.features, [
+            featureValue(feature, keys, matchingValues) is not None
+            for feature in layer.features
         ])
 
-        for layer in tile.layers:
-            if layer.name == "aeroway":
-                optimizeLayer(layer)
-                continue
+    def restrictToTopFeatures(layer, keyName, number):
+        """Delete all features from the layer, except for the features with
+        the largest numerical values for the key name. The remaining features
+        are sorted in descending order.
 
-            if layer.name == "boundary":
-                restrictFeatures(layer, "admin_level", [2.0])
-                restrictTags(layer, ["admin_level"])
-                optimizeLayer(layer)
-                continue
+        :param layer: Layer whose features are deleted
 
-            if layer.name == "landcover":
-                restrictTags(layer, ["class"])
-                optimizeLayer(layer)
-                continue
+        :param keyName: Name of key
 
-            if layer.name == "landuse":
-                restrictTags(layer, ["class"])
-                optimizeLayer(layer)
-                continue
+        :param number: Number of features to keep
+        """
+        if len(layer.features) <= number:
+            return
 
-            if layer.name == "mountain_peak":
-                numPeaks = 5
-                if len(layer.features) > numPeaks:
-
-                    newFeatures = []
-                    for feature in layer.features:
-                        newFeature = vector_tile_pb2.Tile.Feature()
-                        newFeature.CopyFrom(feature)
-                        newFeatures.append(newFeature)
-
-                    def getElevation(feature):
-                        metaData = getMetaData(feature, layer)
-                        if "ele" in metaData:
-                            return metaData["ele"].float_value
-                        return -1
-
-                    newFeatures.sort(reverse=True, key=getElevation)
-                    del newFeatures[numPeaks:]
-                    del layer.features[:]
-                    layer.features.extend(newFeatures)
-
-                restrictTags(layer, ["class", "name_en"])
-                optimizeLayer(layer)
-                continue
+        keys = keyIndices(layer, {keyName})
+        floatValues = {index: value.float_value for (index, value) in enumerate(layer.values)}
 
-            if layer.name == "place":
-                restrictFeatures(layer, "class", ["city", "town", "village"])
-                restrictTags(layer, ["class", "name", "name_en"])
-                optimizeLayer(layer)
-                continue
+        def getValue(feature):
+            value = featureValue(feature, keys, floatValues)
+            return -1 if value is None else value
 
-            if layer.name == "transportation":
-                restrictFeatures(
-                    layer,
-                    "class",
-                    [
-                        "aerialway",
-                        "motorway",
-                        "trunk",
-                        "primary",
-                        "secondary",
-                        "rail"
-                    ]
-                )
-                restrictTags(layer, ["class", "subclass", "network"])
-                optimizeLayer(layer)
-                continue
+        features = layer.features
+        topIndices = set(heapq.nlargest(number, range(len(features)), key=lambda index: getValue(features[index])))
+        deleteItems(features, [index in topIndices for index in range(len(features))])
+        features.sort(reverse=True, key=getValue)
 
-            if layer.name == "transportation_name":
-                restrictFeatures(
-                    layer,
-                    "class",
-                    ["motorway", "trunk", "primary"]
-                )
-                restrictTags(
-                    layer,
-                    [
-                        "class",
-                        "name",
-                        "name_en",
-                        "network",
-                        "ref",
-                        "ref_length"
-                    ]
-                 )
-                optimizeLayer(layer)
-                continue
+    def dropTinyPolygons(layer, minArea):
+        """Delete polygons and inner rings whose area is smaller than
+        minArea. Features without remaining polygons are deleted.
 
-            if layer.name == "water":
-                restrictFeatures(layer, "class", ["river", "lake", "ocean"])
-                restrictTags(layer, ["class"])
-                optimizeLayer(layer)
-                continue
+        :param layer: Layer whose polygons are deleted
 
-            if layer.name == "water_name":
-                restrictTags(layer, ["class", "name", "name_en"])
-                optimizeLayer(layer)
+        :param minArea: Area, in square tile coordinate units
+        """
+        keep = []
+        for feature in layer.features:
+            if feature.type != vector_tile_pb2.Tile.POLYGON:
+                keep.append(True)
                 continue
-
-            if layer.name == "waterway":
-                restrictFeatures(layer, "class", ["stream", "river", "canal"])
-                restrictTags(layer, ["class", "name", "name_en"])
-                optimizeLayer(layer)
+            rings = decodeGeometry(feature.geometry)
+            keptRings = []
+            keepingPolygon = False
+            for ring in rings:
+                area = ringArea(ring)
+                if area > 0:
+                    # Exterior ring, starts a new polygon
+                    keepingPolygon = area >= minArea
+                    if keepingPolygon:
+                        keptRings.append(ring)
+                elif keepingPolygon and -area >= minArea:
+                    keptRings.append(ring)
+            keep.append(len(keptRings) > 0)
+            if keptRings and len(keptRings) < len(rings):
+                del feature.geometry[:]
+                feature.geometry.extend(encodeGeometry(keptRings, vector_tile_pb2.Tile.POLYGON))
+        deleteItems(layer.features, keep)
+
+    def mergeFeatures(layer, method):
+        """Merge features of the same geometry type with identical tags into
+        one feature with a multi-geometry
+
+        :param layer: Layer whose features are merged
+
+        :param method: "concatenate" or "union", see 'layerRules'
+        """
+        groups = {}
+        for (index, feature) in enumerate(layer.features):
+            groups.setdefault((feature.type, tuple(feature.tags)), []).append(index)
+
+        features = layer.features
+        keep = [True]*len(features)
+        for ((geometryType, tags), indices) in groups.items():
+            if len(indices) < 2 or geometryType == vector_tile_pb2.Tile.UNKNOWN:
                 continue
+            parts = []
+            for index in indices:
+                parts.extend(decodeGeometry(features[index].geometry))
+            if method == "union" and geometryType == vector_tile_pb2.Tile.POLYGON:
+                parts = unitePolygons(parts) or parts
+            first = features[indices[0]]
+            first.ClearField("id")
+            del first.geometry[:]
+            first.geometry.extend(encodeGeometry(parts, geometryType))
+            for index in indices[1:]:
+                keep[index] = False
+        deleteItems(features, keep)
+
+    def rebuildDictionary(layer, keyNames):
+        """Delete all tags from all features, except tags whose key names are
+        contained in the set. Then delete unused keys and values from the
+        layer dictionaries, and renumber the tags accordingly.
+
+        Keys are identified by their names and values by their serialization,
+        so that duplicate dictionary entries are merged.
+
+        :param layer: Layer that is to be optimized. The layer is modified
+            in-place.
+
+        :param keyNames: Set of key names, or None to keep all tags
+        """
+        if keyNames is None:
+            keptKeys = range(len(layer.keys))
+        else:
+            keptKeys = keyIndices(layer, keyNames)
+
+        # Maps from old to new dictionary indices
+        keyMap = {}
+        valueMap = {}
+
+        # Maps from dictionary entries to new dictionary indices
+        newKeys = {}
+        newValues = {}
+        newValueMessages = []
+
+        for feature in layer.features:
+            tags = feature.tags
+            newTags = []
+            for i in range(0, len(tags), 2):
+                key = tags[i]
+                if key not in keptKeys:
+                    continue
 
-            print("Error in optimizeTile(). "
-                  "Unknown layer {}".format(layer.name))
-            exit(-1)
+                newKey = keyMap.get(key)
+                if newKey is None:
+                    newKey = newKeys.setdefault(layer.keys[key], len(newKeys))
+                    keyMap[key] = newKey
+
+                value = tags[i+1]
+                newValue = valueMap.get(value)
+                if newValue is None:
+                    valueMessage = layer.values[value]
+                    newValue = newValues.setdefault(valueMessage.SerializeToString(), len(newValues))
+                    if newValue == len(newValueMessages):
+                        newValueMessages.append(valueMessage)
+                    valueMap[value] = newValue
+
+                newTags.append(newKey)
+                newTags.append(newValue)
+            del feature.tags[:]
+            feature.tags.extend(newTags)
+
+        del layer.keys[:]
+        layer.keys.extend(newKeys)
+        del layer.values[:]
+        layer.values.extend(newValueMessages)
+
+    def apply(step, function, *arguments):
+        """Apply one step, and record the bytes it saves if requested"""
+        if savings is None:
+            function(*arguments)
+            return
+        sizeBefore = layer.ByteSize()
+        function(*arguments)
+        savings[step] = savings.get(step, 0) + sizeBefore - layer.ByteSize()
+
+    if "keepFeatures" in rule:
+        apply("keepFeatures", restrictFeatures, layer, *rule["keepFeatures"])
+    if "topFeatures" in rule:
+        apply("topFeatures", restrictToTopFeatures, layer, *rule["topFeatures"])
+    if zoom in rule.get("minPolygonArea", {}) and not keepTinyPolygons:
+        unitsPerPixel = layer.extent/tilePixels
+        apply("minPolygonArea", dropTinyPolygons, layer, rule["minPolygonArea"][zoom]*unitsPerPixel*unitsPerPixel)
+    if zoom in zoomExtents:
+        apply("requantize", requantizeLayer, layer, zoomExtents[zoom])
+    apply("keepTags", rebuildDictionary, layer, rule.get("keepTags"))
+    if zoom in rule.get("mergeFeatures", {}):
+        apply("mergeFeatures", mergeFeatures, layer, rule["mergeFeatures"][zoom])
+
+
+def layerRule(layerName):
+    """Find the compiled rule for a layer
+
+    :param layerName: Name of the layer, which must not be contained in
+        'droppedLayers'
+
+    :returns: Compiled rule
+    """
+    rule = compiledLayerRules.get(layerName)
+    if rule is None:
+        # This function usually runs in a worker process, where exit() would
+        # only terminate the worker. Raise, so that the error reaches the
+        # caller.
+        raise ValueError("Error in optimizeTile(). "
+                         "Unknown layer {}".format(layerName))
+    return rule
 
-    # Open database
-    conn = sqlite3.connect(filename)
-    c = conn.cursor()
 
-    #
-    # Go through all remaining tiles
-    #
-    for row in c.execute('SELECT * FROM tiles'):
-        blob = row[3]
-        unzipedBlob = gzip.decompress(blob)
+def optimizeTile(tile, zoom=None, keepTinyPolygons=False, savings=None):
+    """Optimize a tile
 
-        tile = vector_tile_pb2.Tile()
-        tile.ParseFromString(unzipedBlob)
+    This method optimizes a tile, by removing data this is irrelevant to
+    enrouteFlightMap. It also lowers the number of mountain peaks, removing
+    all but the five highest peaks from each tile. The optimizations are
+    described by the tables 'droppedLayers' and 'layerRules'.
 
-        optimizeTile(tile)
+    :param tile: Tile that is to be optimized. The tile is modified
+        in-place.
 
-        newBlob = gzip.compress(tile.SerializeToString())
-        localCursor = conn.cursor()
-        localCursor.execute("UPDATE tiles SET tile_data=? "
-                            "WHERE zoom_level=? AND tile_column=? "
-                            "AND tile_row=?",
-                            (newBlob, row[0], row[1], row[2]))
+    :param zoom: Zoom level of the tile, or None if unknown. Rules that
+        depend on the zoom level, and the re-quantization described at
+        'zoomExtents', are skipped if None.
 
-    c.execute("REPLACE INTO metadata VALUES (?,?)",
-              (
-                  'attribution',
-                  '<a href="http://www.openstreetmap.org/about/" '
-                  'target="_blank">&copy; OpenStreetMap contributors</a>'
-              ))
-    c.execute("REPLACE INTO metadata VALUES (?,?)", ('name', filename))
-    c.execute("REPLACE INTO metadata VALUES (?,?)",
-              ('version', date.today().strftime("%d/%m/%Y")))
+    :param keepTinyPolygons: See optimizeLayer
 
-    print("Committing changes")
-    conn.commit()
+    :param savings: See optimizeLayer
+    """
+    if savings is not None:
+        droppedBytes = sum(layer.ByteSize() for layer in tile.layers if layer.name in droppedLayers)
+        savings["droppedLayers"] = savings.get("droppedLayers", 0) + droppedBytes
+    deleteItems(tile.layers, [layer.name not in droppedLayers for layer in tile.layers])
+    for layer in tile.layers:
+        optimizeLayer(layer, layerRule(layer.name), zoom, keepTinyPolygons, savings)
 
-    print("Compactifying database")
-    c.execute("vacuum")
-    conn.commit()
 
-    # Close database
-    conn.close()
+def readVarint(data, pos):
+    """Read a varint from protobuf wire format
 
+    :param data: bytes
 
-def removeForeignTiles(filename, country):
+    :param pos: Position of the varint in data
+
+    :returns: Pair (value, position of the first byte after the varint)
     """
-    This method removes all tiles that do not intersect the country.
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (result, pos)
+        shift += 7
+
+
+def encodeVarint(value):
+    """Encode a non-negative integer as a protobuf varint
+
+    :param value: Integer
+
+    :returns: bytes
     """
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
 
-    dbConnection = sqlite3.connect(filename)
-    cursor = dbConnection.cursor()
 
-    tileList = [(z,x,2**z-1-y) for (z,x,y) in cursor.execute('SELECT zoom_level, tile_column, tile_row FROM tiles')]
-    tilesToDelete = foreignTiles(tileList, country)
+def skipField(data, pos, wireType):
+    """Skip over the payload of a protobuf field
 
-    for (z,x,y) in tilesToDelete:
-        cursor.execute('DELETE FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?', (z,x,2**z-1-y))
+    :param data: bytes
 
-    dbConnection.commit()
-    cursor.execute("vacuum")
-    cursor.close()
-    dbConnection.commit()
-    dbConnection.close()
+    :param pos: Position of the payload, directly after the field tag
 
+    :param wireType: Wire type of the field
 
-def pbf2mbtiles(pbfFileName, minLon, minLat, maxLon, maxLat, mbtilesFileBaseName, country):
-    """Converts openstreetmap PBF file into mbtiles
+    :returns: Pair (start of the payload, position of the first byte after
+        the field). For length-delimited fields, the start of the payload is
+        the position after the length prefix.
+    """
+    if wireType == 0:
+        (value, end) = readVarint(data, pos)
+        return (pos, end)
+    if wireType == 1:
+        return (pos, pos+8)
+    if wireType == 2:
+        (length, start) = readVarint(data, pos)
+        return (start, start+length)
+    if wireType == 5:
+        return (pos, pos+4)
+    raise ValueError("Unsupported protobuf wire type {}".format(wireType))
+
+
+def splitTileData(data):
+    """Split a serialized tile into its top-level fields, without parsing it
+
+    :param data: Serialized vector_tile_pb2.Tile
+
+    :returns: List of triples (layer name, field, layer). Here, 'field' is
+        the complete wire format encoding of the field, including its tag,
+        and 'layer' is the serialized layer. For fields other than layers,
+        the layer name and the layer are None.
+    """
+    fields = []
+    pos = 0
+    while pos < len(data):
+        fieldStart = pos
+        (tag, pos) = readVarint(data, pos)
+        (payloadStart, pos) = skipField(data, pos, tag & 7)
+        if tag != (3 << 3) | 2:
+            fields.append( (None, data[fieldStart:pos], None) )
+            continue
+
+        # Find the name of the layer, which is field 1 of the layer message
+        layerData = data[payloadStart:pos]
+        name = None
+        layerPos = 0
+        while layerPos < len(layerData):
+            (layerTag, layerPos) = readVarint(layerData, layerPos)
+            (start, layerPos) = skipField(layerData, layerPos, layerTag & 7)
+            if layerTag == (1 << 3) | 2:
+                name = layerData[start:layerPos].decode('utf-8')
+                break
+        fields.append( (name, data[fieldStart:pos], layerData) )
+    return fields
+
+
+def optimizeTileData(data, zoom=None, keepTinyPolygons=False, savings=None):
+    """Optimize a serialized tile
+
+    This method has the same effect as optimizeTile, but works on the
+    serialized tile. Before anything is parsed, the top-level wire format is
+    scanned for layers. Dropped layers are discarded as raw bytes, and layers
+    whose rule is empty are copied as raw bytes, unless they are re-quantized.
+    Only the remaining layers are parsed, optimized and serialized again.
+
+    :param data: Serialized vector_tile_pb2.Tile
+
+    :param zoom: Zoom level of the tile, see optimizeTile
+
+    :param keepTinyPolygons: See optimizeLayer
+
+    :param savings: See optimizeLayer. Sizes are counted without the field
+        headers of the layers.
+
+    :returns: Serialized optimized tile
+    """
+    parts = []
+    for (name, field, layerData) in splitTileData(data):
+        if layerData is None:
+            parts.append(field)
+            continue
+        if name in droppedLayers:
+            if savings is not None:
+                savings["droppedLayers"] = savings.get("droppedLayers", 0) + len(layerData)
+            continue
+        rule = layerRule(name)
+        if not rule and zoom not in zoomExtents:
+            parts.append(field)
+            continue
+        layer = vector_tile_pb2.Tile.Layer()
+        layer.ParseFromString(layerData)
+        optimizeLayer(layer, rule, zoom, keepTinyPolygons, savings)
+        layerData = layer.SerializeToString()
+        parts.append(b'\x1a' + encodeVarint(len(layerData)) + layerData)
+    return b''.join(parts)
+
+
+def optimizeTileBlob(blob, zoom=None, keepTinyPolygons=False, savings=None):
+    """Optimize a gzip-compressed tile, as stored in an mbtiles file
+
+    :param blob: gzip-compressed, serialized tile
+
+    :param zoom: Zoom level of the tile, see optimizeTile
+
+    :param keepTinyPolygons: See optimizeLayer
+
+    :param savings: See optimizeTileData
+
+    :returns: gzip-compressed, serialized optimized tile. The gzip header
+        carries no timestamp, so that identical tiles compress to identical
+        bytes and can be deduplicated.
+    """
+    return gzip.compress(optimizeTileData(gzip.decompress(blob), zoom, keepTinyPolygons, savings), mtime=0)
 
-    This method converts a PBF file with openstreetmap data into an mbtiles
-    file. The output contains tiles for zoom level 7--10 and it optimized for
-    use with the enrouteMap style.
 
-    The coordiante arguments specify a bounding box. The box is enlarged to fit
-    zoom level 6 tile boundaries. This way, it is ensured that the output does
-    not contain any half-filled tiles.
+#
+# Worker processes
+#
+# The pools below are started by a fork server instead of being forked from
+# the calling process. Callers such as generateBaseMaps.py run several regions
+# in threads, and forking a process while other threads hold locks can
+# deadlock the child. Scripts that use these pools must therefore guard their
+# main code with "if __name__ == '__main__'".
+#
+
+processContext = multiprocessing.get_context("forkserver")
+
+
+#
+# Cache of optimized tiles
+#
+# Between two runs, most tiles produced by tilemaker are byte-identical. The
+# cache is an SQLite file that maps a hash of the raw tile blob, its zoom level
+# and 'optimizationHash' to the optimized blob, so that unchanged tiles need
+# not be optimized again. Entries that have not been used for
+# 'tileCacheMaxAge' seconds are removed at the end of every run.
+#
+
+tileCacheMaxAge = 90*24*3600
+
+
+def tileCacheKey(blob, zoom, keepTinyPolygons=False):
+    """Compute the key of a tile in the tile cache
+
+    :param blob: gzip-compressed, serialized tile, as produced by tilemaker
+
+    :param zoom: Zoom level of the tile
+
+    :param keepTinyPolygons: See optimizeLayer
+
+    :returns: bytes
+    """
+    return hashlib.sha256(optimizationHash + bytes([zoom, keepTinyPolygons]) + blob).digest()
+
+
+def connectTileCache(filename):
+    """Open the tile cache, creating it if necessary
+
+    The cache is opened in WAL mode with a generous busy timeout, so that
+    several processes and threads can use it at the same time.
+
+    :param filename: SQLite file of the tile cache
+
+    :returns: sqlite3 connection
+    """
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(filename, timeout=600, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS tiles (key BLOB PRIMARY KEY, tile_data BLOB, last_used INTEGER)")
+    connection.commit()
+    return connection
+
+
+def pruneTileCache(filename, maxAge=None):
+    """Remove entries from the tile cache that have not been used recently
+
+    :param filename: SQLite file of the tile cache
+
+    :param maxAge: Age in seconds. Defaults to 'tileCacheMaxAge'.
+    """
+    if maxAge is None:
+        maxAge = tileCacheMaxAge
+    connection = connectTileCache(filename)
+    numDeleted = connection.execute("DELETE FROM tiles WHERE last_used < ?", (int(time.time()) - maxAge,)).rowcount
+    connection.commit()
+    connection.close()
+    if numDeleted > 0:
+        print("Removed {} old entries from tile cache {}".format(numDeleted, filename))
+
+
+def optimizeTileRow(row, keepTinyPolygons=False):
+    """Optimize a row of the mbtiles table 'tiles'
+
+    This is the unit of work that rewriteVectorTiles hands to its worker
+    processes.
+
+    :param row: Tuple (zoom_level, tile_column, tile_row, tile_data). If
+        tile_data is None, the row is returned unchanged. This is used for
+        tiles that are found in the tile cache.
+
+    :param keepTinyPolygons: See optimizeLayer
+
+    :returns: Pair (row, savings). Here, row is the tuple (zoom_level,
+        tile_column, tile_row, optimized tile_data), and savings is a
+        dictionary as described at 'optimizationSteps', empty for rows that
+        are returned unchanged.
+    """
+    (z, x, y, blob) = row
+    savings = {}
+    if blob is None:
+        return (row, savings)
+    return ((z, x, y, optimizeTileBlob(blob, z, keepTinyPolygons, savings)), savings)
+
+
+def foreignTileKeys(filename, country):
+    """Find the tiles of an mbtiles file that do not intersect a country
+
+    :param filename: mbtiles file
+
+    :param country: Country. If None, no tile is foreign.
+
+    :returns: Set of triples (zoom_level, tile_column, tile_row) in the TMS
+        numbering used by mbtiles
+    """
+    if country is None:
+        return set()
+    # Note that foreignTiles uses the slippy map numbering, where y runs from
+    # north to south.
+    tileList = [(z,x,2**z-1-y) for (z,x,y) in mbtiles.readTileKeys(filename)]
+    return {(z,x,2**z-1-y) for (z,x,y) in foreignTiles(tileList, country)}
+
+
+def rewriteVectorTiles(sourceFileName, targetFileName, country=None, optimize=True, processes=None, deduplicate=False, name=None, cache=None, keepTinyPolygons=False):
+    """Copy an mbtiles file, removing foreign tiles and optimizing the rest
+
+    This method streams the tiles of the source file in key order, drops
+    tiles that do not intersect the country and optimizes the remaining
+    tiles. The result is written into a freshly created file whose index is
+    built at the end, so that neither row updates nor VACUUM are needed.
+
+    Optimization removes data this is irrelevant to enrouteFlightMap, see
+    optimizeTile. It runs in a pipeline: a reader streams tiles from the
+    source file, a pool of worker processes decompresses, optimizes and
+    recompresses them, and a writer thread inserts the results in large
+    transactions. If the tiles are optimized, the method also adds a few
+    entries to the map file metadata.
+
+    :param sourceFileName: mbtiles file that is read
+
+    :param targetFileName: mbtiles file that is written. An existing file of
+        that name is overwritten.
+
+    :param country: Country. Tiles that do not intersect this country are
+        dropped. If None, all tiles are kept.
+
+    :param optimize: If True, optimize the tiles
+
+    :param processes: Number of worker processes. Defaults to the number of
+        CPUs.
+
+    :param deduplicate: If True, write the deduplicated layout described in
+        the module 'mbtiles'
+
+    :param name: Name entry of the metadata of optimized files. Defaults to
+        targetFileName.
+
+    :param cache: SQLite file of the tile cache, see 'tileCacheMaxAge'. If
+        None, no cache is used.
+
+    :param keepTinyPolygons: See optimizeLayer
+    """
+
+    if processes is None:
+        processes = os.cpu_count()
+
+    exclude = foreignTileKeys(sourceFileName, country)
+
+    if not optimize:
+        numTiles = mbtiles.copyTiles(sourceFileName, targetFileName, exclude, deduplicate=deduplicate)
+        print("Copied {} tiles, dropped {} foreign tiles".format(numTiles, len(exclude)))
+        return
+
+    metadata = mbtiles.readMetadata(sourceFileName)
+    metadata['attribution'] = ('<a href="http://www.openstreetmap.org/about/" '
+                               'target="_blank">&copy; OpenStreetMap contributors</a>')
+    metadata['name'] = targetFileName if name is None else name
+    metadata['version'] = date.today().strftime("%d/%m/%Y")
+
+    # Tiles are read by a generator that runs in the task handler thread of
+    # the process pool. The semaphore limits the number of tiles that have been
+    # read but not yet written, so that memory consumption stays bounded.
+    maxTilesInFlight = 64*processes
+    tilesInFlight = threading.Semaphore(maxTilesInFlight)
+    stopReading = threading.Event()
+
+    bytesRead = 0
+
+    # With a cache, the reader looks up every tile. Tiles found in the cache
+    # are handed to the pool without data, so that the workers pass them
+    # through. For every tile, the reader appends the pair (cache key, cached
+    # blob or None) to this queue, in the order in which the tiles are read.
+    cacheLookups = collections.deque()
+
+    def readTiles():
+        nonlocal bytesRead
+        cacheConnection = connectTileCache(cache) if cache is not None else None
+        try:
+            for row in mbtiles.readTiles(sourceFileName, ordered=True):
+                if row[:3] in exclude:
+                    continue
+                tilesInFlight.acquire()
+                if stopReading.is_set():
+                    return
+                bytesRead += len(row[3])
+                if cacheConnection is not None:
+                    key = tileCacheKey(row[3], row[0], keepTinyPolygons)
+                    cached = cacheConnection.execute("SELECT tile_data FROM tiles WHERE key=?", (key,)).fetchone()
+                    cacheLookups.append( (key, None if cached is None else cached[0]) )
+                    if cached is not None:
+                        row = (row[0], row[1], row[2], None)
+                yield row
+        finally:
+            if cacheConnection is not None:
+                cacheConnection.close()
+
+    # Pool.imap returns the results in the order of the input, so that the
+    # tiles are written in key order, and so that the results match the
+    # entries of cacheLookups
+    numTiles = 0
+    numCached = 0
+    bytesWritten = 0
+    savings = dict.fromkeys(optimizationSteps, 0)
+    cacheConnection = connectTileCache(cache) if cache is not None else None
+    newEntries = []
+    usedKeys = []
+
+    def writeCacheEntries():
+        now = int(time.time())
+        cacheConnection.executemany("INSERT OR REPLACE INTO tiles VALUES (?,?,?)",
+                                    [(key, data, now) for (key, data) in newEntries])
+        cacheConnection.executemany("UPDATE tiles SET last_used=? WHERE key=?",
+                                    [(now, key) for key in usedKeys])
+        cacheConnection.commit()
+        newEntries.clear()
+        usedKeys.clear()
+
+    with mbtiles.MBTilesWriter(targetFileName, metadata, deduplicate=deduplicate) as writer:
+        try:
+            with processContext.Pool(processes) as pool:
+                worker = functools.partial(optimizeTileRow, keepTinyPolygons=keepTinyPolygons)
+                for (row, tileSavings) in pool.imap(worker, readTiles(), chunksize=16):
+                    tilesInFlight.release()
+                    for (step, saved) in tileSavings.items():
+                        savings[step] += saved
+                    if cacheConnection is not None:
+                        (key, cached) = cacheLookups.popleft()
+                        if cached is None:
+                            newEntries.append( (key, row[3]) )
+                        else:
+                            row = (row[0], row[1], row[2], cached)
+                            usedKeys.append(key)
+                            numCached += 1
+                        if len(newEntries) + len(usedKeys) >= 1000:
+                            writeCacheEntries()
+                    writer.put(*row)
+                    numTiles += 1
+                    bytesWritten += len(row[3])
+        finally:
+            # Unblock the reader, in case the loop above was left early
+            stopReading.set()
+            tilesInFlight.release(maxTilesInFlight)
+            if cacheConnection is not None:
+                writeCacheEntries()
+                cacheConnection.close()
+    print("Optimized {} tiles, dropped {} foreign tiles".format(numTiles, len(exclude)))
+    print("Tile data shrunk from {:.1f} MB to {:.1f} MB".format(bytesRead/1024/1024, bytesWritten/1024/1024))
+    print("Uncompressed bytes saved by each step, in the {} tiles optimized in this run:".format(numTiles-numCached))
+    for step in optimizationSteps:
+        print("  {:<16}{:>10.1f} MB".format(step, savings[step]/1024/1024))
+    if cache is not None:
+        print("Found {} of {} tiles in the tile cache".format(numCached, numTiles))
+        pruneTileCache(cache)
+
+
+def layerStatistics(layerData):
+    """Count the contents of a serialized layer
+
+    :param layerData: Serialized vector_tile_pb2.Tile.Layer
+
+    :returns: List [features, vertices, keys, values, bytes]
+    """
+    layer = vector_tile_pb2.Tile.Layer()
+    layer.ParseFromString(layerData)
+    vertices = 0
+    for feature in layer.features:
+        geometry = feature.geometry
+        i = 0
+        while i < len(geometry):
+            commandId = geometry[i] & 7
+            count = geometry[i] >> 3
+            i += 1
+            # MoveTo and LineTo carry one vertex per repetition, ClosePath none
+            if commandId in (1, 2):
+                vertices += count
+                i += 2*count
+    return [len(layer.features), vertices, len(layer.keys), len(layer.values), len(layerData)]
+
+
+def tileStatistics(blob):
+    """Count the contents of a gzip-compressed tile, layer by layer
+
+    :param blob: gzip-compressed, serialized tile
+
+    :returns: Dictionary with entries 'compressedBytes', 'uncompressedBytes'
+        and 'layers'. The last entry maps layer names to the lists returned by
+        layerStatistics.
+    """
+    data = gzip.decompress(blob)
+    layers = {}
+    for (name, field, layerData) in splitTileData(data):
+        if layerData is not None:
+            layers[name] = layerStatistics(layerData)
+    return {'compressedBytes': len(blob), 'uncompressedBytes': len(data), 'layers': layers}
+
+
+def tileStatisticsRow(row, keepTinyPolygons=False):
+    """Count the contents of a row of the mbtiles table 'tiles', before and
+    after optimization
+
+    This is the unit of work that vectorTileStatistics hands to its worker
+    processes.
+
+    :param row: Tuple (zoom_level, tile_column, tile_row, tile_data)
+
+    :param keepTinyPolygons: See optimizeLayer
+
+    :returns: Quadruple (zoom_level, statistics before, statistics after,
+        savings), with statistics as returned by tileStatistics and savings
+        as described at 'optimizationSteps'
+    """
+    (z, x, y, blob) = row
+    savings = {}
+    optimizedBlob = optimizeTileBlob(blob, z, keepTinyPolygons, savings)
+    return (z, tileStatistics(blob), tileStatistics(optimizedBlob), savings)
+
+
+def vectorTileStatistics(filename, country=None, processes=None, keepTinyPolygons=False):
+    """Compute size statistics of an mbtiles file, before and after
+    optimization
+
+    The file is not modified. Every tile is optimized in memory, as
+    rewriteVectorTiles would do, and both versions are counted. The counts
+    are summed up per zoom level, and per layer within each zoom level.
+
+    :param filename: mbtiles file with tiles that have not been optimized yet,
+        as written by tilemaker
+
+    :param country: Country. Tiles that do not intersect this country are
+        left out, as rewriteVectorTiles would do. If None, all tiles are
+        counted.
+
+    :param processes: Number of worker processes. Defaults to the number of
+        CPUs.
+
+    :param keepTinyPolygons: See optimizeLayer
+
+    :returns: Dictionary with entries 'before', 'after' and 'savings'. The
+        first two map zoom levels to dictionaries with the entries 'tiles',
+        'compressedBytes', 'uncompressedBytes' and 'layers'. The last entry
+        maps layer names to dictionaries with the entries 'tiles', 'features',
+        'vertices', 'keys', 'values' and 'bytes', where 'bytes' is the
+        uncompressed size. The entry 'savings' maps zoom levels to
+        dictionaries as described at 'optimizationSteps'.
+    """
+    if processes is None:
+        processes = os.cpu_count()
+    exclude = foreignTileKeys(filename, country)
+    layerFields = ['features', 'vertices', 'keys', 'values', 'bytes']
+
+    statistics = {'before': {}, 'after': {}, 'savings': {}}
+
+    def add(zoomStatistics, tile):
+        zoomStatistics['tiles'] += 1
+        zoomStatistics['compressedBytes'] += tile['compressedBytes']
+        zoomStatistics['uncompressedBytes'] += tile['uncompressedBytes']
+        for (name, counts) in tile['layers'].items():
+            layer = zoomStatistics['layers'].setdefault(name, dict.fromkeys(['tiles'] + layerFields, 0))
+            layer['tiles'] += 1
+            for (field, count) in zip(layerFields, counts):
+                layer[field] += count
+
+    def readTiles():
+        for row in mbtiles.readTiles(filename):
+            if row[:3] not in exclude:
+                yield row
+
+    worker = functools.partial(tileStatisticsRow, keepTinyPolygons=keepTinyPolygons)
+    with processContext.Pool(processes) as pool:
+        for (z, before, after, savings) in pool.imap_unordered(worker, readTiles(), chunksize=16):
+            for (key, tile) in (('before', before), ('after', after)):
+                if z not in statistics[key]:
+                    statistics[key][z] = {'tiles': 0, 'compressedBytes': 0, 'uncompressedBytes': 0, 'layers': {}}
+                add(statistics[key][z], tile)
+            zoomSavings = statistics['savings'].setdefault(z, dict.fromkeys(optimizationSteps, 0))
+            for (step, saved) in savings.items():
+                zoomSavings[step] += saved
+    return statistics
+
+
+def writeStatisticsReport(statistics, baseFileName):
+    """Write size statistics as JSON and as text
+
+    :param statistics: Dictionary, as returned by vectorTileStatistics
+
+    :param baseFileName: Name of the output files, without ending. The files
+        baseFileName.json and baseFileName.txt are overwritten if they exist.
+    """
+    with open(baseFileName+'.json', 'w') as file:
+        json.dump(statistics, file, indent=4, sort_keys=True)
+
+    def megabytes(size):
+        return '{:.2f}'.format(size/1024/1024)
+
+    lines = []
+    for z in sorted(statistics['before']):
+        before = statistics['before'][z]
+        after = statistics['after'][z]
+        lines.append('Zoom {}: {} tiles, compressed {} MB -> {} MB, uncompressed {} MB -> {} MB'.format(
+            z, before['tiles'],
+            megabytes(before['compressedBytes']), megabytes(after['compressedBytes']),
+            megabytes(before['uncompressedBytes']), megabytes(after['uncompressedBytes'])))
+        lines.append('  {:<22}{:>8}{:>22}{:>24}{:>16}{:>18}{:>22}'.format(
+            'layer', 'tiles', 'features', 'vertices', 'keys', 'values', 'MB'))
+        for name in sorted(before['layers'], key=lambda name: -before['layers'][name]['bytes']):
+            layerBefore = before['layers'][name]
+            layerAfter = after['layers'].get(name, dict.fromkeys(layerBefore, 0))
+            columns = ['{} -> {}'.format(layerBefore[field], layerAfter[field])
+                       for field in ('features', 'vertices', 'keys', 'values')]
+            columns.append('{} -> {}'.format(megabytes(layerBefore['bytes']), megabytes(layerAfter['bytes'])))
+            lines.append('  {:<22}{:>8}{:>22}{:>24}{:>16}{:>18}{:>22}'.format(name, layerBefore['tiles'], *columns))
+        lines.append('  Uncompressed MB saved by each step: ' + ', '.join(
+            '{} {}'.format(step, megabytes(statistics['savings'][z][step])) for step in optimizationSteps))
+        lines.append('')
+    with open(baseFileName+'.txt', 'w') as file:
+        file.write('\n'.join(lines))
+
+
+#
+# In-place variants
+#
+# The scripts in this repository call rewriteVectorTiles, which writes into a
+# new file. The functions optimizeVectorTiles, removeForeignTiles and
+# pbf2mbtiles are older entry points. They are kept, as part of the public
+# interface of this module, for scripts that process single files.
+#
+
+
+def optimizeVectorTiles(filename, processes=None, deduplicate=False, cache=None):
+    """Optimize an mbtiles file
+
+    This method optimizes an mbtiles file, by removing data this is irrelevant
+    to enrouteFlightMap. It also lowers the number of mountain peaks, removing
+    all but the five highest peaks from each tile. See rewriteVectorTiles for
+    details.
+
+    :param filename: mbtiles file. The file is replaced by an optimized copy.
+
+    :param processes: Number of worker processes. Defaults to the number of
+        CPUs.
+
+    :param deduplicate: If True, write the deduplicated layout described in
+        the module 'mbtiles'
+
+    :param cache: SQLite file of the tile cache, see rewriteVectorTiles
+    """
+    rewriteVectorTiles(filename, filename+".tmp", processes=processes, deduplicate=deduplicate, name=filename, cache=cache)
+    os.replace(filename+".tmp", filename)
+
+
+def removeForeignTiles(filename, country):
+    """
+    This method removes all tiles that do not intersect the country. The file
+    is replaced by a copy that does not contain these tiles.
+    """
+    rewriteVectorTiles(filename, filename+".tmp", country=country, optimize=False)
+    os.replace(filename+".tmp", filename)
 
-    :param pbfFileName: Name of input file
+
+def extendedBBox(minLon, minLat, maxLon, maxLat):
+    """Enlarge a bounding box to fit zoom level 6 tile boundaries
 
     :param minLon: minimum longitude of the bounding box
 
@@ -390,11 +1452,7 @@ def pbf2mbtiles(pbfFileName, minLon, minLat, maxLon, maxLat, mbtilesFileBaseName
 
     :param maxLat: maximum latitude of the bounding box
 
-    :param mbtilesFileBaseName: Name of output file, without ending and without
-        path. The file will be overwritten if exists.
-
-    :param country: Country. Tiles that do not intersect this country will be
-        removed.
+    :returns: Quadruple (minLon, minLat, maxLon, maxLat) of the enlarged box
     """
 
     def deg2num(lat_deg, lon_deg, zoom):
@@ -425,29 +1483,235 @@ def pbf2mbtiles(pbfFileName, minLon, minLat, maxLon, maxLat, mbtilesFileBaseName
     (extMinLat, extMinLon) = num2deg(x, y+1, 6.0)
     (x, y) = deg2num(maxLat, maxLon, 6.0)
     (extMaxLat, extMaxLon) = num2deg(x+1, y, 6.0)
+    return (extMinLon, extMinLat, extMaxLon, extMaxLat)
 
-    print('Run Osmium extract')
-    subprocess.run(
-        "osmium extract --bbox {},{},{},{} {} "
-        "-o bboxed.pbf --overwrite".format(extMinLon, extMinLat, extMaxLon, extMaxLat, pbfFileName),
-        shell=True,
-        check=True
-    )
 
-    print('Run tilemaker')
+def extractRegions(pbfFileName, extracts, directory="."):
+    """Cut bounding boxes out of an openstreetmap PBF file
+
+    All extracts are produced by a single osmium run, which reads the input
+    file only once. The bounding boxes are enlarged to fit zoom level 6 tile
+    boundaries, see extendedBBox.
+
+    :param pbfFileName: Name of input file
+
+    :param extracts: List of pairs (output file name, bounding box), where
+        the bounding box is a list [minLon, minLat, maxLon, maxLat]. The
+        output file names are relative to the directory. Existing files are
+        overwritten.
+
+    :param directory: Directory for the output files. It is created if
+        necessary.
+    """
+    os.makedirs(directory, exist_ok=True)
+    config = {
+        "directory": directory,
+        "extracts": [
+            {"output": outputFileName, "output_format": "pbf", "bbox": list(extendedBBox(*bbox))}
+            for (outputFileName, bbox) in extracts
+        ]
+    }
+    configFileName = os.path.join(directory, "osmium-extracts.json")
+    with open(configFileName, "w") as file:
+        json.dump(config, file, indent=4)
+
+    print('Run Osmium extract for {} regions'.format(len(extracts)))
     subprocess.run(
-        ["tilemaker",
-        "--config", "tilemaker/config.json",
-        "--process", "tilemaker/process.lua",
-        "--bbox", "{},{},{},{}".format(minLon, minLat, maxLon, maxLat, mbtilesFileBaseName+".mbtiles"),
-        "--input", "bboxed.pbf",
-        "--output", mbtilesFileBaseName+".mbtiles"],
+        ["osmium", "extract",
+         "--config", configFileName,
+         pbfFileName,
+         "--overwrite"],
         check=True
     )
-    os.remove("bboxed.pbf")
+    os.remove(configFileName)
+
 
-    print('Remove tiles that do not intersect {}'.format(country))
-    removeForeignTiles(mbtilesFileBaseName+".mbtiles", country)
+def runTilemaker(pbfFileName, minLon, minLat, maxLon, maxLat, mbtilesFileName, threads=None):
+    """Render an openstreetmap PBF file into raw vector tiles
 
-    print('Optimize vector tiles')
-    optimizeVectorTiles(mbtilesFileBaseName+".mbtiles")
+    This method runs tilemaker with the configuration found in the directory
+    'tilemaker'. The output is neither optimized nor cut to any country.
+
+    :param pbfFileName: Name of input file
+
+    :param minLon: minimum longitude of the bounding box
+
+    :param minLat: minimum latitude of the bounding box
+
+    :param maxLon: maximum longitude of the bounding box
+
+    :param maxLat: maximum latitude of the bounding box
+
+    :param mbtilesFileName: Name of output file. The file will be overwritten
+        if exists.
+
+    :param threads: Number of threads used by tilemaker. Defaults to the
+        number of CPUs.
+    """
+    print('Run tilemaker on {}'.format(pbfFileName))
+    if os.path.exists(mbtilesFileName):
+        os.remove(mbtilesFileName)
+    command = ["tilemaker",
+               "--config", "tilemaker/config.json",
+               "--process", "tilemaker/process.lua",
+               "--bbox", "{},{},{},{}".format(minLon, minLat, maxLon, maxLat),
+               "--input", pbfFileName,
+               "--output", mbtilesFileName]
+    if threads is not None:
+        command += ["--threads", str(threads)]
+    subprocess.run(command, check=True)
+
+
+def pbf2mbtiles(pbfFileName, minLon, minLat, maxLon, maxLat, mbtilesFileBaseName, country, deduplicate=False, extract=True, cache=None):
+    """Converts openstreetmap PBF file into mbtiles
+
+    This method converts a PBF file with openstreetmap data into an mbtiles
+    file. The output contains tiles for zoom level 7--10 and it optimized for
+    use with the enrouteMap style.
+
+    The coordiante arguments specify a bounding box. The box is enlarged to fit
+    zoom level 6 tile boundaries. This way, it is ensured that the output does
+    not contain any half-filled tiles.
+
+    :param pbfFileName: Name of input file
+
+    :param minLon: minimum longitude of the bounding box
+
+    :param minLat: minimum latitude of the bounding box
+
+    :param maxLon: maximum longitude of the bounding box
+
+    :param maxLat: maximum latitude of the bounding box
+
+    :param mbtilesFileBaseName: Name of output file, without ending and without
+        path. The file will be overwritten if exists.
+
+    :param country: Country. Tiles that do not intersect this country will be
+        removed.
+
+    :param deduplicate: If True, write the output in the deduplicated layout
+        described in the module 'mbtiles'
+
+    :param extract: If False, the input file has already been cut to the
+        enlarged bounding box, for instance by extractRegions, and is passed
+        to tilemaker directly
+
+    :param cache: SQLite file of the tile cache, see rewriteVectorTiles
+    """
+
+    inputFileName = pbfFileName
+    if extract:
+        inputFileName = mbtilesFileBaseName+".bboxed.pbf"
+        extractRegions(pbfFileName, [(inputFileName, [minLon, minLat, maxLon, maxLat])])
+
+    runTilemaker(inputFileName, minLon, minLat, maxLon, maxLat, mbtilesFileBaseName+".raw.mbtiles")
+    if extract:
+        os.remove(inputFileName)
+
+    print('Remove tiles that do not intersect {} and optimize vector tiles'.format(country))
+    rewriteVectorTiles(mbtilesFileBaseName+".raw.mbtiles", mbtilesFileBaseName+".mbtiles", country, deduplicate=deduplicate, cache=cache)
+    os.remove(mbtilesFileBaseName+".raw.mbtiles")
+
+
+def regionCoverage(tileKeys, minLon, minLat, maxLon, maxLat, country):
+    """Find the tiles of a region in a larger mbtiles file
+
+    A tile belongs to the region if it intersects the bounding box and the
+    buffered boundary of the country, see foreignTiles.
+
+    :param tileKeys: List of triples (zoom_level, tile_column, tile_row) in
+        the TMS numbering used by mbtiles, as returned by mbtiles.readTileKeys
+
+    :param minLon: minimum longitude of the bounding box
+
+    :param minLat: minimum latitude of the bounding box
+
+    :param maxLon: maximum longitude of the bounding box
+
+    :param maxLat: maximum latitude of the bounding box
+
+    :param country: Country
+
+    :returns: List of triples (zoom_level, tile_column, tile_row) in the TMS
+        numbering
+    """
+
+    def tileRange(zoom):
+        n = 2 ** zoom
+        def xtile(lon):
+            return min(n-1, max(0, int((lon + 180.0) / 360.0 * n)))
+        def ytile(lat):
+            lat_rad = math.radians(lat)
+            return min(n-1, max(0, int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)))
+        return (xtile(minLon), ytile(maxLat), xtile(maxLon), ytile(minLat))
+
+    ranges = {}
+    tileList = []
+    for (z, x, y) in tileKeys:
+        if z not in ranges:
+            ranges[z] = tileRange(z)
+        (minX, minY, maxX, maxY) = ranges[z]
+        y = 2**z-1-y
+        if minX <= x <= maxX and minY <= y <= maxY:
+            tileList.append((z, x, y))
+
+    foreign = set(foreignTiles(tileList, country))
+    return [(z, x, 2**z-1-y) for (z, x, y) in tileList if (z, x, y) not in foreign]
+
+
+def sliceRegion(masterFileName, minLon, minLat, maxLon, maxLat, mbtilesFileName, country, deduplicate=False, name=None):
+    """Cut the map of a region out of an optimized mbtiles file that covers a
+    larger area, such as a continent
+
+    This way, tiles that are shared by several regions are rendered and
+    optimized only once. The tiles are copied with mbtiles.sliceTiles.
+
+    :param masterFileName: Optimized mbtiles file, as written by
+        rewriteVectorTiles
+
+    :param minLon: minimum longitude of the bounding box
+
+    :param minLat: minimum latitude of the bounding box
+
+    :param maxLon: maximum longitude of the bounding box
+
+    :param maxLat: maximum latitude of the bounding box
+
+    :param mbtilesFileName: Name of output file. The file will be overwritten
+        if exists.
+
+    :param country: Country. Tiles that do not intersect this country are
+        left out.
+
+    :param deduplicate: If True, write the deduplicated layout described in
+        the module 'mbtiles'
+
+    :param name: Name entry of the metadata. Defaults to mbtilesFileName.
+    """
+    print('Cut {} out of {}'.format(country, masterFileName))
+    keys = regionCoverage(mbtiles.readTileKeys(masterFileName), minLon, minLat, maxLon, maxLat, country)
+    metadata = {
+        'name': mbtilesFileName if name is None else name,
+        'bounds': '{},{},{},{}'.format(minLon, minLat, maxLon, maxLat)
+    }
+    masterCenter = mbtiles.readMetadata(masterFileName).get('center')
+    if masterCenter is not None:
+        # Keep the zoom level of the center, but move it into the region
+        metadata['center'] = '{},{},{}'.format((minLon+maxLon)/2, (minLat+maxLat)/2, masterCenter.split(',')[-1])
+    numTiles = mbtiles.sliceTiles(masterFileName, mbtilesFileName, keys, metadata, deduplicate=deduplicate)
+    print("Copied {} tiles".format(numTiles))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report the sizes of the layers of a vector tile mbtiles file, before and after optimization")
+    parser.add_argument("input", help="mbtiles file, as written by tilemaker")
+    parser.add_argument("output", help="Name of the report files, without ending")
+    parser.add_argument("--country", default=None,
+                        help="Leave out tiles that do not intersect this country")
+    parser.add_argument("--keep-tiny-polygons", action="store_true",
+                        help="Do not apply the rule minPolygonArea")
+    args = parser.parse_args()
+
+    writeStatisticsReport(vectorTileStatistics(args.input, args.country, keepTinyPolygons=args.keep_tiny_polygons), args.output)